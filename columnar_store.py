@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+
+import sys
+import datetime
+import numpy as np
+
+# The values of every row, kept column by column and addressed by row id, which is the
+# order rows were added in and never changes. Timestamps and deltas are also kept as
+# seconds in numpy arrays, so that whole columns can be worked on at once.
+
+INITIAL_CAPACITY = 1024
+
+
+def sort_key(value):
+    """A key that orders values of any type without Python comparison functions.
+
+    None comes first, then numbers, timestamps and deltas, then anything else by its text.
+    """
+    if value is None:
+        return (0,)
+    if isinstance(value, datetime.datetime):
+        value = value.timestamp()
+    elif isinstance(value, datetime.timedelta):
+        value = value.total_seconds()
+    if isinstance(value, (int, float)):
+        return (1, value)
+    return (2, value if isinstance(value, str) else str(value))
+
+
+def same_value(a, b):
+    """Whether b would look exactly like a, e.g. not just the same instant in another time zone."""
+    if a is b:
+        return True
+    if type(a) is not type(b) or a != b:
+        return False
+    return not isinstance(a, datetime.datetime) or a.utcoffset() == b.utcoffset()
+
+
+class ColumnarStore:
+    """Columns of row values.
+
+    timestamp_fields hold datetimes, along with their POSIX timestamps; delta_fields hold
+    timedeltas, only as seconds. Missing values are None, or NaN in the arrays. Values of
+    interned_fields are interned strings, e.g. the row states, so every row shares them.
+    sparse_fields, e.g. tags that most files don't have, only take up memory for the rows
+    that have a value.
+    """
+
+    def __init__(self, fields, timestamp_fields=(), delta_fields=(), interned_fields=(), sparse_fields=()):
+        self.n_rows = 0
+        self.capacity = INITIAL_CAPACITY
+        self.objects = {field: [] for field in fields if field not in delta_fields and field not in sparse_fields}
+        self.sparse = {field: {} for field in sparse_fields}
+        self.seconds = {
+            field: np.full(self.capacity, np.nan)
+            for field in (*timestamp_fields, *delta_fields)
+        }
+        self.timestamp_fields = frozenset(timestamp_fields)
+        self.delta_fields = frozenset(delta_fields)
+        self.interned_fields = frozenset(interned_fields)
+        # The sort_key of every row, for each field without an array of seconds that has been sorted by
+        self.sort_keys = {}
+
+    def __len__(self):
+        return self.n_rows
+
+    def append(self, values):
+        """Add a row, with None for any fields not given, and return its id."""
+        i = self.n_rows
+        if i == self.capacity:
+            self.capacity *= 2
+            for field, array in self.seconds.items():
+                self.seconds[field] = np.concatenate((array, np.full(self.capacity - len(array), np.nan)))
+        for column in self.objects.values():
+            column.append(None)
+        for keys in self.sort_keys.values():
+            keys.append(sort_key(None))
+        self.n_rows += 1
+        for field, value in values.items():
+            self.set(i, field, value)
+        return i
+
+    def get(self, i, field):
+        if field in self.delta_fields:
+            seconds = self.seconds[field][i]
+            return None if np.isnan(seconds) else datetime.timedelta(seconds=float(seconds))
+        if field in self.sparse:
+            return self.sparse[field].get(i)
+        return self.objects[field][i]
+
+    def set(self, i, field, value):
+        """Set one value, returning whether it changed."""
+        if field in self.delta_fields:
+            seconds = np.nan if value is None else value.total_seconds()
+            old = self.seconds[field][i]
+            if old == seconds or (np.isnan(old) and np.isnan(seconds)):
+                return False
+            self.seconds[field][i] = seconds
+            return True
+
+        if field in self.sparse:
+            column = self.sparse[field]
+            if same_value(column.get(i), value):
+                return False
+            if value is None:
+                del column[i]
+            else:
+                column[i] = value
+            self.update_sort_key(i, field, value)
+            return True
+
+        column = self.objects[field]
+        if same_value(column[i], value):
+            return False
+        if field in self.interned_fields and value is not None:
+            value = sys.intern(value)
+        column[i] = value
+        if field in self.timestamp_fields:
+            self.seconds[field][i] = np.nan if value is None else value.timestamp()
+        else:
+            self.update_sort_key(i, field, value)
+        return True
+
+    def update_sort_key(self, i, field, value):
+        keys = self.sort_keys.get(field)
+        if keys is not None:
+            keys[i] = sort_key(value)
+
+    def sort_order(self, field, ids):
+        """The permutation that stably sorts an array of row ids by field, with missing values first.
+
+        Timestamps and deltas are sorted by numpy on their seconds, and other fields by
+        their sort keys, so no Python code runs per comparison.
+        """
+        if field in self.seconds:
+            seconds = self.seconds[field][ids]
+            return np.argsort(np.where(np.isnan(seconds), -np.inf, seconds), kind="stable")
+        keys = self.sort_keys.get(field)
+        if keys is None:
+            keys = self.sort_keys[field] = [sort_key(self.get(i, field)) for i in range(self.n_rows)]
+        ids_keys = [keys[i] for i in ids.tolist()]
+        return np.array(sorted(range(len(ids_keys)), key=ids_keys.__getitem__), dtype=np.intp)
+
+    def get_seconds(self, field, ids):
+        """The values of a timestamp or delta field for an array of row ids, in seconds."""
+        return self.seconds[field][ids]
+
+    def set_seconds(self, field, ids, seconds):
+        """Set the values of a delta field for an array of row ids, returning a mask of those that changed."""
+        column = self.seconds[field]
+        changed = ~((column[ids] == seconds) | (np.isnan(column[ids]) & np.isnan(seconds)))
+        column[ids] = seconds
+        return changed
+
+    def set_many(self, field, ids, values):
+        """Set a field to each of values for an array of row ids, returning a mask of those that changed."""
+        return np.array([self.set(i, field, value) for i, value in zip(ids.tolist(), values)], dtype=bool)
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+
+import datetime
+import numpy as np
+import sortedcontainers
+
+# The delta of each row is interpolated from the anchors, the rows whose delta was set by
+# hand. An anchor only affects the rows between its neighbouring anchors, so when one
+# changes, only that range of timestamps is marked as dirty, and the rows in it are
+# found through a TimestampIndex.
+
+
+class TimestampIndex:
+    """The loaded rows in timestamp order, so that the rows in a range of timestamps can be found quickly."""
+
+    def __init__(self):
+        # (POSIX timestamp, path, row), ordered by timestamp
+        self.entries = sortedcontainers.SortedKeyList(key=lambda entry: entry[0])
+        self.entries_by_path = {}
+
+    def set(self, row, timestamp):
+        path = row["full_path"]
+        old_entry = self.entries_by_path.pop(path, None)
+        if old_entry is not None:
+            self.entries.remove(old_entry)
+        if timestamp is not None:
+            entry = self.entries_by_path[path] = (timestamp.timestamp(), path, row)
+            self.entries.add(entry)
+
+    def entries_between(self, start=None, end=None):
+        """The (POSIX timestamp, row) of the rows with timestamps from start to end inclusive.
+
+        Either of start and end can be None for no limit.
+        """
+        return [(timestamp, row) for timestamp, _, row in self.entries.irange_key(start, end)]
+
+
+class Anchors:
+    """The anchors' deltas by timestamp, and the range of timestamps whose rows' deltas are out of date.
+
+    Rows are given the delta interpolated linearly between the anchors either side of
+    them, or that of the first or last anchor beyond them. With no anchors, every row
+    has the same, default, delta.
+    """
+
+    def __init__(self):
+        self.deltas = sortedcontainers.SortedDict()
+        # The range of POSIX timestamps whose rows still need their delta updating, if any,
+        # either end of which can be None for no limit
+        self.dirty_interval = None
+
+    def __len__(self):
+        return len(self.deltas)
+
+    def __contains__(self, key):
+        return key in self.deltas
+
+    def arrays(self):
+        """The anchors' timestamps, as POSIX timestamps in increasing order, and their deltas in seconds."""
+        return (
+            np.array([ts.timestamp() for ts in self.deltas.keys()]),
+            np.array([delta.total_seconds() for delta in self.deltas.values()]),
+        )
+
+    def get_deltas(self, timestamps, default_delta, arrays=None):
+        """The deltas in seconds for an array of POSIX timestamps."""
+        if len(self.deltas) == 0:
+            return np.full(len(timestamps), default_delta.total_seconds())
+        anchor_timestamps, anchor_deltas = arrays or self.arrays()
+        return np.interp(timestamps, anchor_timestamps, anchor_deltas)
+
+    def get_delta(self, timestamp, default_delta):
+        seconds, = self.get_deltas(np.array([timestamp.timestamp()]), default_delta).tolist()
+        return datetime.timedelta(seconds=seconds)
+
+    def interval_around(self, key):
+        """The range of POSIX timestamps whose delta depends on the anchor at key.
+
+        That's from the anchor before it to the one after it, with None for no limit.
+        """
+        lower_i = self.deltas.bisect_left(key) - 1
+        upper_i = self.deltas.bisect_right(key)
+        return (
+            self.deltas.keys()[lower_i].timestamp() if lower_i >= 0 else None,
+            self.deltas.keys()[upper_i].timestamp() if upper_i < len(self.deltas) else None,
+        )
+
+    def mark_dirty(self, start=None, end=None):
+        """Add a range of POSIX timestamps to the dirty interval, which by default is all of them."""
+        if self.dirty_interval is not None:
+            dirty_start, dirty_end = self.dirty_interval
+            start = None if start is None or dirty_start is None else min(start, dirty_start)
+            end = None if end is None or dirty_end is None else max(end, dirty_end)
+        self.dirty_interval = start, end
+
+    def mark_changed(self, key, had_anchors):
+        if had_anchors and len(self.deltas) > 0:
+            self.mark_dirty(*self.interval_around(key))
+        else:
+            # Every row has the default delta, or did until now
+            self.mark_dirty()
+
+    def set(self, key, delta):
+        had_anchors = len(self.deltas) > 0
+        self.deltas[key] = delta
+        self.mark_changed(key, had_anchors)
+
+    def remove(self, key):
+        """Remove the anchor at key, if there is one; either way, the rows around it are marked as dirty."""
+        had_anchors = len(self.deltas) > 0
+        self.deltas.pop(key, None)
+        self.mark_changed(key, had_anchors)
+
+    def forget(self, keys):
+        """Remove the anchors at keys, e.g. as their rows' deltas have been written to the files.
+
+        Unlike remove, if no anchors are left, the rows are left with the deltas they have
+        rather than all being given the default delta.
+        """
+        keys = [key for key in keys if key in self.deltas]
+        for key in keys:
+            del self.deltas[key]
+        if len(self.deltas) > 0:
+            for key in keys:
+                self.mark_dirty(*self.interval_around(key))
+
+    def clear(self):
+        self.deltas.clear()
+        self.mark_dirty()
+
+    def dirty_rows(self, index, default_delta, is_idle):
+        """The rows to update, with arrays of their new deltas in seconds and of whether each is an anchor.
+
+        These are the rows of the TimestampIndex in the dirty interval for which is_idle
+        is true. Rows that are skipped, e.g. as they're being loaded, have to be given
+        their delta once they're done.
+        """
+        if self.dirty_interval is None:
+            return [], np.empty(0), np.empty(0, dtype=bool)
+        entries = [(ts, row) for ts, row in index.entries_between(*self.dirty_interval) if is_idle(row)]
+        timestamps = np.array([ts for ts, row in entries], dtype=float)
+        arrays = self.arrays()
+        return (
+            [row for ts, row in entries],
+            self.get_deltas(timestamps, default_delta, arrays),
+            np.isin(timestamps, arrays[0]),
+        )
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import queue
+import itertools
+import threading
+import contextlib
+import subprocess
+
+
+class ExiftoolError(Exception):
+    pass
+
+
+class ExiftoolProcess:
+    """A long-lived `exiftool -stay_open True -@ -` process.
+
+    Each request is a list of arguments, one per line, terminated by `-execute<N>`.
+    exiftool answers with the command's output followed by `{ready<N>}` on stdout,
+    and `-echo4` is used to put the same marker on stderr so both streams can be
+    read up to the end of the response. stderr is drained by a thread all along, so
+    that exiftool can't block on it while the response is read from stdout.
+    """
+
+    def __init__(self, executable="exiftool"):
+        self.proc = subprocess.Popen(
+            [executable, "-stay_open", "True", "-@", "-"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+        self.counter = itertools.count()
+        self.stderr_lines = queue.Queue()
+        threading.Thread(target=self._pump_lines, args=(self.proc.stderr, self.stderr_lines), daemon=True).start()
+
+    @staticmethod
+    def _pump_lines(stream, lines):
+        for line in iter(stream.readline, b""):
+            lines.put(line)
+        lines.put(b"")
+
+    @staticmethod
+    def _read_until(readline, marker):
+        lines = []
+        while True:
+            line = readline()
+            if not line:
+                raise ExiftoolError("exiftool exited unexpectedly")
+            if line.rstrip(b"\r\n").endswith(marker):
+                lines.append(line.rstrip(b"\r\n")[:-len(marker)])
+                return b"".join(lines)
+            lines.append(line)
+
+    def execute(self, *args):
+        n = next(self.counter)
+        marker = b"{ready%d}" % n
+        request = b"".join(os.fsencode(a) + b"\n" for a in args)
+        request += b"-echo4\n" + marker + b"\n-execute%d\n" % n
+        self.proc.stdin.write(request)
+        self.proc.stdin.flush()
+        stdout = self._read_until(self.proc.stdout.readline, marker)
+        stderr = self._read_until(self.stderr_lines.get, marker)
+        return stdout, stderr
+
+    def close(self):
+        try:
+            self.proc.stdin.write(b"-stay_open\nFalse\n")
+            self.proc.stdin.flush()
+            self.proc.stdin.close()
+            self.proc.wait(timeout=5)
+        except (OSError, subprocess.TimeoutExpired):
+            self.proc.kill()
+            self.proc.wait()
+
+
+class ExiftoolPool:
+    """A small pool of ExiftoolProcess workers, started on demand and shared between threads.
+
+    The executable can be overridden with the EXIFTOOL environment variable, e.g. to point
+    at the `fake_exiftool` stand-in.
+    """
+
+    def __init__(self, size, executable=None):
+        self.executable = executable or os.environ.get("EXIFTOOL", "exiftool")
+        self.slots = threading.BoundedSemaphore(size)
+        self.idle = queue.LifoQueue()
+
+    @contextlib.contextmanager
+    def worker(self):
+        with self.slots:
+            try:
+                worker = self.idle.get_nowait()
+            except queue.Empty:
+                worker = ExiftoolProcess(self.executable)
+            try:
+                yield worker
+            except BaseException:
+                # The request/response framing may be out of step now, so don't reuse it
+                worker.close()
+                raise
+            self.idle.put(worker)
+
+    def execute(self, *args, check=True):
+        with self.worker() as worker:
+            stdout, stderr = worker.execute(*args)
+        if check:
+            errors = [line for line in stderr.splitlines() if line.startswith(b"Error")]
+            if errors:
+                raise ExiftoolError(b"\n".join(errors).decode('utf8', 'replace'))
+        return stdout, stderr
+
+    def close(self):
+        while True:
+            try:
+                worker = self.idle.get_nowait()
+            except queue.Empty:
+                return
+            worker.close()
+
+
+def main():
+    pool = ExiftoolPool(size=1)
+    try:
+        stdout, stderr = pool.execute(*sys.argv[1:], check=False)
+        sys.stdout.buffer.write(stdout)
+        sys.stderr.buffer.write(stderr)
+    finally:
+        pool.close()
+
+
+if __name__ == "__main__":
+    main()
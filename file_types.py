@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+
+import sys
+import mts
+import quicktime
+
+# Classifies files by their first few bytes, so that each is only given to the readers that
+# can make sense of it, and files that can't hold a timestamp aren't parsed at all.
+
+JPEG = "JPEG"
+TIFF = "TIFF"  # Including TIFF-based raw formats such as NEF, CR2, DNG and ARW
+PNG = "PNG"
+OTHER_EXIV = "Other image"  # Formats that only pyexiv2 reads
+ISOBMFF_IMAGE = "ISOBMFF image"  # HEIF, AVIF, CR3
+ISOBMFF = "ISOBMFF"  # QuickTime and MP4 movies
+MTS = "MTS"
+UNSUPPORTED = "Unsupported"
+
+# Files that pyexiv2 should be asked to read
+EXIV_TYPES = {JPEG, TIFF, PNG, OTHER_EXIV, ISOBMFF_IMAGE}
+# Files that have QuickTime tags
+QUICKTIME_TYPES = {ISOBMFF_IMAGE, ISOBMFF}
+
+SNIFF_SIZE = 512
+
+TIFF_MAGICS = (
+    b"II*\0",
+    b"MM\0*",
+    b"IIRO",  # Olympus ORF
+    b"IIRS",  # Olympus ORF
+    b"MMOR",  # Olympus ORF
+    b"IIU\0",  # Panasonic RW2
+)
+OTHER_EXIV_MAGICS = (
+    b"FUJIFILMCCD-RAW",
+    b"II\x1a\0\0\0HEAPCCDR",  # Canon CRW
+    b"\0MRM",  # Minolta MRW
+    b"8BPS",  # Photoshop
+    b"\0\0\0\x0cjP  \r\n\x87\n",  # JPEG 2000
+    b"GIF8",
+    b"<?xpacket",  # XMP sidecar
+    b"<x:xmpmeta",  # XMP sidecar
+)
+ISOBMFF_IMAGE_BRANDS = {b"heic", b"heix", b"heim", b"heis", b"hevc", b"mif1", b"msf1", b"avif", b"crx "}
+
+
+def is_transport_stream(head):
+    """Whether head looks like an MPEG transport stream, either plain or with the 4 byte timecode of .MTS/.M2TS files."""
+    try:
+        mts.find_packet_layout(head)
+    except mts.UnsupportedLayout:
+        return False
+    return True
+
+
+def sniff_bytes(head):
+    if head.startswith(b"\xff\xd8\xff"):
+        return JPEG
+    if head.startswith(TIFF_MAGICS):
+        return TIFF
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return PNG
+    if head.startswith(OTHER_EXIV_MAGICS) or (head[:4] == b"RIFF" and head[8:12] == b"WEBP"):
+        return OTHER_EXIV
+    if head[4:8] in quicktime.TOP_LEVEL_BOX_TYPES:
+        if head[4:8] == b"ftyp" and head[8:12] in ISOBMFF_IMAGE_BRANDS:
+            return ISOBMFF_IMAGE
+        return ISOBMFF
+    if is_transport_stream(head):
+        return MTS
+    return UNSUPPORTED
+
+
+def sniff(path):
+    """Classify a file by its magic bytes, as one of the types above."""
+    try:
+        with open(path, "rb") as f:
+            head = f.read(SNIFF_SIZE)
+    except OSError:
+        return UNSUPPORTED
+    return sniff_bytes(head)
+
+
+def main():
+    for path in sys.argv[1:]:
+        print(f"{path}: {sniff(path)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,403 @@
+#!/usr/bin/env python3
+
+import sys
+import json
+import datetime
+import file_types
+import jpeg_metadata
+import quicktime
+import mts
+import metadata_reader
+from metadata_reader import (
+    EXIF_TIMESTAMP_TAGS, EXIF_TAGS, XMP_TIMESTAMP_TAGS, XMP_TAGS, IPTC_TIMESTAMP_TAGS, IPTC_TAGS,
+    QUICKTIME_TIMESTAMP_TAGS, QUICKTIME_TAGS, NIKON_TAGS, AVCHD_TAGS,
+)
+
+# Every file is read and written by exactly one FormatHandler, chosen by find_handler from
+# its sniffed type and where it is. Handlers are used as classes, so that they can be sent
+# to worker processes, and are given the FileStore as the context for anything shared
+# between files, such as the exiftool pool and the AVCHD directories.
+
+EXIFTOOL_DATE_FORMAT = "%Y-%m-%dT%H:%M:%S"
+UTC = datetime.timezone(datetime.timedelta())
+# The row field saying that the file has no Exif.Image.TimeZoneOffset, so the row's is a guess
+TIMEZONE_OFFSET_GUESSED = "timezone-offset-guessed"
+
+HANDLERS = {}
+
+
+def register(handler):
+    HANDLERS[handler.name] = handler
+    return handler
+
+
+def find_handler(context, path, file_type):
+    return next((h for h in HANDLERS.values() if h.handles(context, path, file_type)), OtherHandler)
+
+
+def guess_timezone_offset(tags, tag_name):
+    """The offset in hours of the time zone of a naive timestamp tag, guessed from the other tags."""
+    for reference_tag in ("Xmp.xmp.CreateDate",):
+        reference_dt = tags[reference_tag]
+        if reference_dt is not None:
+            break
+    else:
+        return 0
+    naive_dt = tags[tag_name].replace(tzinfo=datetime.timezone(datetime.timedelta()))
+    diff = naive_dt - reference_dt
+    tzoffset = round(diff.total_seconds() / 60**2)
+    # new_diff_seconds = (naive_dt.replace(tzinfo=datetime.timezone(datetime.timedelta(hours=tzoffset))) - reference_dt).total_seconds()
+    # app.notify(
+    #     f"Inferred capture timezone of {tzoffset:+d} hours",
+    #     f"This synchronizes the timestamp with the {reference_tag} with a difference of {new_diff_seconds} seconds. "
+    #     "If this difference is more than a few seconds, the results might be unexpected. "
+    #     "If any updates are saved, the new timezone will be written into the tags."
+    # )
+    return tzoffset
+
+
+def fill_in_exif_timezone_offset(tags):
+    """Guess the Exif.Image.TimeZoneOffset of a row with an EXIF DateTimeOriginal but no offset.
+
+    tags is the row, or any dict with every tag in it, and is also given TIMEZONE_OFFSET_GUESSED.
+    """
+    guessed = tags["Exif.Photo.DateTimeOriginal"] is not None and tags["Exif.Image.TimeZoneOffset"] is None
+    if guessed:
+        tags["Exif.Image.TimeZoneOffset"] = guess_timezone_offset(tags, "Exif.Photo.DateTimeOriginal")
+    tags[TIMEZONE_OFFSET_GUESSED] = guessed
+
+
+def round_datetime_to_second(ts):
+    if ts.microsecond >= 500000:
+        return ts.replace(microsecond=0) + datetime.timedelta(seconds=1)
+    else:
+        return ts.replace(microsecond=0)
+
+
+class FormatHandler:
+    """Reads and writes the timestamp tags of one kind of file.
+
+    read is run for each file, in a worker thread or process. It returns the file's tags,
+    and whether the file also has to go through read_many, which is given batches of up to
+    batch_size such files at once. write_many is given (path, values) pairs, where values
+    comes from new_values, and returns the values actually written to each file.
+    """
+
+    name = "Other"
+    # The row columns this handler fills in, which are what new_values is given
+    tags = ()
+    batch_size = 1
+    # Whether the tags read can be kept in the metadata cache
+    cacheable = True
+
+    @classmethod
+    def handles(cls, context, path, file_type):
+        return False
+
+    @classmethod
+    def prepare_reads(cls, context):
+        pass
+
+    @classmethod
+    def read(cls, path, file_type):
+        return {}, False
+
+    @classmethod
+    def read_many(cls, context, paths):
+        """Read the remaining tags of many files, returning a dict of them for each."""
+        return [{} for _ in paths]
+
+    @classmethod
+    def new_values(cls, tags, ts_delta, timezone, timezone_offset_hours):
+        """The values to write, given the current values of the handler's tags."""
+        return {}
+
+    @classmethod
+    def write_many(cls, context, items):
+        return [{} for _ in items]
+
+    @classmethod
+    def finish_writes(cls, context):
+        pass
+
+
+class OtherHandler(FormatHandler):
+    """Files without any timestamp tags, of which only the mtime is used."""
+
+
+@register
+class ImageHandler(FormatHandler):
+    """EXIF, XMP and IPTC tags, read and written with pyexiv2 unless the JPEG fast paths apply."""
+
+    name = "Image"
+    tags = EXIF_TAGS + XMP_TAGS + IPTC_TAGS + (TIMEZONE_OFFSET_GUESSED,)
+    file_types = file_types.EXIV_TYPES - {file_types.ISOBMFF_IMAGE}
+
+    @classmethod
+    def handles(cls, context, path, file_type):
+        return file_type in cls.file_types
+
+    @classmethod
+    def read(cls, path, file_type):
+        return metadata_reader.get_exiv_tags(path, file_type), False
+
+    @classmethod
+    def new_values(cls, tags, ts_delta, timezone, timezone_offset_hours):
+        values = {}
+        for tag_name in XMP_TIMESTAMP_TAGS + IPTC_TIMESTAMP_TAGS:
+            ts = tags.get(tag_name)
+            if ts is not None:
+                values[tag_name] = round_datetime_to_second(ts.astimezone(timezone) + ts_delta)
+        tz_offset = tags.get("Exif.Image.TimeZoneOffset")
+        exif_timezone = timezone
+        if tags.get(TIMEZONE_OFFSET_GUESSED):
+            # A guessed offset isn't written, as adding the tag would mean rewriting the
+            # file with pyexiv2 rather than patching its timestamps in place. They're left
+            # in the guessed time zone instead, which is guessed again when it's reloaded
+            exif_timezone = datetime.timezone(datetime.timedelta(hours=tz_offset))
+        for tag_name in EXIF_TIMESTAMP_TAGS:
+            ts = tags.get(tag_name)
+            if ts is not None:
+                ts = ts.replace(tzinfo=datetime.timezone(datetime.timedelta(hours=tz_offset)))
+                values[tag_name] = round_datetime_to_second(ts.astimezone(exif_timezone) + ts_delta)
+        if tz_offset is not None and not tags.get(TIMEZONE_OFFSET_GUESSED):
+            values["Exif.Image.TimeZoneOffset"] = timezone_offset_hours
+        return values
+
+    @classmethod
+    def write(cls, path, values):
+        # When only EXIF values change, they can usually be patched in place
+        if all(tag_name in EXIF_TAGS for tag_name in values):
+            if jpeg_metadata.write_exif_tags(path, values):
+                return values
+
+        metadata = metadata_reader.get_exiv_metadata(path)
+        if metadata is None:
+            return {}
+        for tag_name, value in values.items():
+            if isinstance(tag_name, tuple):
+                date_tag_name, time_tag_name = tag_name
+                metadata[date_tag_name].value = [value]
+                metadata[time_tag_name].value = [value]
+            elif tag_name == "Exif.Image.TimeZoneOffset":
+                metadata[tag_name] = value
+            else:
+                metadata[tag_name].value = value
+        metadata.write()
+        return values
+
+    @classmethod
+    def write_many(cls, context, items):
+        return [cls.write(path, values) if values else {} for path, values in items]
+
+
+@register
+class QuickTimeHandler(FormatHandler):
+    """QuickTime header timestamps, patched natively where possible and otherwise handled by exiftool.
+
+    Files with maker notes that only exiftool understands, e.g. Nikon's, are read through it
+    in batches.
+    """
+
+    name = "QuickTime"
+    tags = QUICKTIME_TAGS + NIKON_TAGS
+    batch_size = 200
+
+    @classmethod
+    def handles(cls, context, path, file_type):
+        return file_type == file_types.ISOBMFF
+
+    @classmethod
+    def read(cls, path, file_type):
+        tags = quicktime.read_tags(path)
+        if tags is None:
+            return {}, True
+        return tags, False
+
+    @classmethod
+    def read_many(cls, context, paths):
+        """Read the QUICKTIME_TAGS and NIKON_TAGS of many files with a single exiftool request."""
+        stdout, _ = context.exiftool.execute(
+            '-json', '-d', EXIFTOOL_DATE_FORMAT,
+            *('-'+t for t in cls.tags),
+            *paths,
+            check=False,
+        )
+        results = {}
+        tag_names_by_suffix = {t.split(':', 1)[1]: t for t in cls.tags}
+        for file_info in json.loads(stdout) if stdout.strip() else ():
+            result = results[file_info.pop("SourceFile")] = {}
+            for tag_suffix, value in file_info.items():
+                # exiftool also reports e.g. "Error" and "Warning" for damaged files
+                tag_name = tag_names_by_suffix.get(tag_suffix)
+                if tag_name is None:
+                    continue
+                if tag_name in QUICKTIME_TIMESTAMP_TAGS:
+                    try:
+                        value = datetime.datetime.fromisoformat(value).replace(tzinfo=UTC)
+                    except ValueError:
+                        # exiftool passes through unparseable dates such as "0000:00:00 00:00:00"
+                        continue
+                result[tag_name] = value
+        return [results.get(path, {}) for path in paths]
+
+    @classmethod
+    def new_values(cls, tags, ts_delta, timezone, timezone_offset_hours):
+        return {
+            t: tags[t].astimezone(UTC) + ts_delta
+            for t in QUICKTIME_TIMESTAMP_TAGS
+            if tags.get(t) is not None
+        }
+
+    @classmethod
+    def write(cls, context, path, values):
+        if not quicktime.write_tags(path, values):
+            args = [
+                "-{}={}".format(tag_name, ts.strftime("%Y:%m:%d %H:%M:%S"))
+                for tag_name, ts in values.items()
+            ]
+            context.exiftool.execute('-overwrite_original', path, *args)
+        return values
+
+    @classmethod
+    def write_many(cls, context, items):
+        return [cls.write(context, path, values) if values else {} for path, values in items]
+
+
+@register
+class IsobmffImageHandler(FormatHandler):
+    """HEIF, AVIF and CR3 images, which have both EXIF and QuickTime tags."""
+
+    name = "ISOBMFF image"
+    tags = ImageHandler.tags + QuickTimeHandler.tags
+    batch_size = QuickTimeHandler.batch_size
+
+    @classmethod
+    def handles(cls, context, path, file_type):
+        return file_type == file_types.ISOBMFF_IMAGE
+
+    @classmethod
+    def read(cls, path, file_type):
+        tags, _ = ImageHandler.read(path, file_type)
+        if tags.get("Exif.Photo.DateTimeOriginal") is not None:
+            return tags, False
+        quicktime_tags, incomplete = QuickTimeHandler.read(path, file_type)
+        tags.update(quicktime_tags)
+        return tags, incomplete
+
+    @classmethod
+    def read_many(cls, context, paths):
+        return QuickTimeHandler.read_many(context, paths)
+
+    @classmethod
+    def new_values(cls, tags, ts_delta, timezone, timezone_offset_hours):
+        return {
+            **ImageHandler.new_values(tags, ts_delta, timezone, timezone_offset_hours),
+            **QuickTimeHandler.new_values(tags, ts_delta, timezone, timezone_offset_hours),
+        }
+
+    @classmethod
+    def write_many(cls, context, items):
+        results = []
+        for path, values in items:
+            image_values = {t: v for t, v in values.items() if t in ImageHandler.tags}
+            quicktime_values = {t: v for t, v in values.items() if t in QuickTimeHandler.tags}
+            written = ImageHandler.write(path, image_values) if image_values else {}
+            if quicktime_values:
+                written.update(QuickTimeHandler.write(context, path, quicktime_values))
+            results.append(written)
+        return results
+
+
+@register
+class AvchdHandler(FormatHandler):
+    """Clips of an AVCHD directory, whose timestamps are kept in its playlist (MPL) files.
+
+    Their durations are read from their CLIPINF files too, but never written.
+
+    As the playlists aren't part of the clip files, these aren't cached.
+    """
+
+    name = "AVCHD"
+    tags = AVCHD_TAGS
+    batch_size = 200
+    cacheable = False
+
+    @classmethod
+    def handles(cls, context, path, file_type):
+        return file_type == file_types.MTS and context.find_avchd_dir(path) is not None
+
+    @classmethod
+    def prepare_reads(cls, context):
+        for avchd_db in context.avchd_dirs:
+            avchd_db.read()
+        context.index_avchd_dirs()
+
+    @classmethod
+    def read(cls, path, file_type):
+        return {}, True
+
+    @classmethod
+    def read_many(cls, context, paths):
+        results = []
+        for path in paths:
+            avchd_db = context.find_avchd_dir(path)
+            result = {"AVCHD:Timestamp": avchd_db.get_mts(path)["datetime"]}
+            clip_info = avchd_db.get_clip_info(path)
+            if clip_info is not None:
+                result["AVCHD:Duration"] = clip_info.duration
+            results.append(result)
+        return results
+
+    @classmethod
+    def new_values(cls, tags, ts_delta, timezone, timezone_offset_hours):
+        ts = tags.get("AVCHD:Timestamp")
+        if ts is None:
+            return {}
+        return {"AVCHD:Timestamp": round_datetime_to_second(ts.astimezone(timezone) + ts_delta)}
+
+    @classmethod
+    def write_many(cls, context, items):
+        # Only updates the playlists in memory; they're written out by finish_writes
+        for path, values in items:
+            if values:
+                context.find_avchd_dir(path).set_datetime(path, values["AVCHD:Timestamp"])
+        return [values for path, values in items]
+
+    @classmethod
+    def finish_writes(cls, context):
+        for avchd_db in context.avchd_dirs:
+            avchd_db.write()
+
+
+@register
+class MtsHandler(FormatHandler):
+    """Clips outside of an AVCHD directory, whose time stamp is only in the video stream itself.
+
+    The time stamp is only read, so saving these only changes their mtime.
+    """
+
+    name = "MTS"
+    tags = AVCHD_TAGS
+
+    @classmethod
+    def handles(cls, context, path, file_type):
+        return file_type == file_types.MTS
+
+    @classmethod
+    def read(cls, path, file_type):
+        ts = mts.read_timestamp(path)
+        return ({} if ts is None else {"AVCHD:Timestamp": ts}), False
+
+
+
+def main():
+    for path in sys.argv[1:]:
+        file_type = file_types.sniff(path)
+        handler = MtsHandler if file_type == file_types.MTS else find_handler(None, path, file_type)
+        tags, incomplete = handler.read(path, file_type)
+        print(f"{path}: {handler.name}: {tags}{' (incomplete)' if incomplete else ''}")
+
+
+if __name__ == "__main__":
+    main()
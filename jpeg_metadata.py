@@ -0,0 +1,363 @@
+#!/usr/bin/env python3
+
+import re
+import sys
+import mmap
+import struct
+import datetime
+
+# Reads the handful of timestamp-related EXIF, XMP and IPTC tags from a JPEG by walking
+# its markers up to SOS in an mmap, without going through pyexiv2. The results are keyed
+# and typed the same way as the values pyexiv2 would give. The EXIF timestamps of JPEG
+# and TIFF-based files can also be patched in place. Anything unusual raises
+# UnsupportedLayout internally, and read_tags/write_exif_tags return None/False so that
+# the caller can fall back to pyexiv2.
+
+EXIF_IFD0_TAGS = {
+    0x0110: "Exif.Image.Model",
+    0x0132: "Exif.Image.DateTime",
+    0x882a: "Exif.Image.TimeZoneOffset",
+    0x9003: "Exif.Image.DateTimeOriginal",
+    0xc71b: "Exif.Image.PreviewDateTime",
+}
+EXIF_PHOTO_TAGS = {
+    0x9003: "Exif.Photo.DateTimeOriginal",
+    0x9004: "Exif.Photo.DateTimeDigitized",
+}
+# The callers assume that none of these are present, so leave such files to pyexiv2
+EXIF_PHOTO_SUBSEC_TAGS = {0x9290, 0x9291, 0x9292}
+EXIF_IFD_POINTER = 0x8769
+
+XMP_TAGS = {
+    "Xmp.xmp.CreateDate": b"xmp:CreateDate",
+    "Xmp.photoshop.DateCreated": b"photoshop:DateCreated",
+}
+
+IPTC_TAGS = {
+    ("Iptc.Application2.DateCreated", "Iptc.Application2.TimeCreated"): (55, 60),
+    ("Iptc.Application2.DigitizationDate", "Iptc.Application2.DigitizationTime"): (62, 63),
+}
+
+EXIF_HEADER = b"Exif\0\0"
+XMP_HEADER = b"http://ns.adobe.com/xap/1.0/\0"
+PHOTOSHOP_HEADER = b"Photoshop 3.0\0"
+
+TIFF_ASCII = 2
+TIFF_LONG = 4
+TIFF_SSHORT = 8
+TIFF_IFD = 13
+TIFF_TYPE_SIZES = {1: 1, 2: 1, 3: 2, 4: 4, 5: 8, 6: 1, 7: 1, 8: 2, 9: 4, 10: 8, 11: 4, 12: 8, 13: 4}
+
+XMP_DATETIME_RE = re.compile(rb'(\d{4})-(\d\d)-(\d\d)T(\d\d):(\d\d):(\d\d)(\.\d+)?(Z|[+-]\d\d:\d\d)?')
+
+
+class UnsupportedLayout(Exception):
+    pass
+
+
+class VerificationError(Exception):
+    pass
+
+
+def iter_segments(data):
+    """Yield (marker, payload_start, payload_end) for each marker segment before the start of scan."""
+    if data[:2] != b"\xff\xd8":
+        raise UnsupportedLayout("Not a JPEG")
+    pos = 2
+    while True:
+        if data[pos] != 0xff:
+            raise UnsupportedLayout("Expected a marker")
+        while data[pos] == 0xff:
+            pos += 1
+        marker = data[pos]
+        pos += 1
+        if marker in {0xda, 0xd9}:
+            return
+        if marker == 0x01 or 0xd0 <= marker <= 0xd7:
+            continue
+        length, = struct.unpack_from(">H", data, pos)
+        if length < 2 or pos + length > len(data):
+            raise UnsupportedLayout("Truncated segment")
+        yield marker, pos + 2, pos + length
+        pos += length
+
+
+class TiffReader:
+    """Reads a TIFF structure starting at base; all other offsets are relative to base."""
+
+    def __init__(self, data, base=0):
+        self.data = data
+        self.base = base
+        byte_order = data[base:base + 2]
+        if byte_order == b"II":
+            self.endian = "<"
+        elif byte_order == b"MM":
+            self.endian = ">"
+        else:
+            raise UnsupportedLayout("Bad TIFF byte order")
+        magic, self.ifd0_offset = self.unpack("HI", 2)
+        if magic != 42:
+            raise UnsupportedLayout("Bad TIFF magic")
+
+    def unpack(self, fmt, offset):
+        return struct.unpack_from(self.endian + fmt, self.data, self.base + offset)
+
+    def iter_ifd(self, offset):
+        """Yield (tag, type, count, value_offset) for each entry of the IFD at offset."""
+        n_entries, = self.unpack("H", offset)
+        for i in range(n_entries):
+            entry_offset = offset + 2 + 12*i
+            tag, typ, count = self.unpack("HHI", entry_offset)
+            yield tag, typ, count, entry_offset + 8
+
+    def read_ascii(self, typ, count, value_offset):
+        if typ != TIFF_ASCII:
+            raise UnsupportedLayout("Expected an ASCII value")
+        if count > 4:
+            value_offset, = self.unpack("I", value_offset)
+        raw = self.data[self.base + value_offset:self.base + value_offset + count]
+        if len(raw) != count:
+            raise UnsupportedLayout("Truncated ASCII value")
+        return raw.split(b"\0", 1)[0].decode("ascii")
+
+    def read_datetime(self, typ, count, value_offset):
+        try:
+            return datetime.datetime.strptime(self.read_ascii(typ, count, value_offset), "%Y:%m:%d %H:%M:%S")
+        except (ValueError, UnicodeDecodeError):
+            raise UnsupportedLayout("Malformed EXIF datetime")
+
+    def read_sshort(self, typ, count, value_offset):
+        if typ != TIFF_SSHORT or count != 1:
+            raise UnsupportedLayout("Expected a single SSHORT value")
+        return self.unpack("h", value_offset)[0]
+
+    def read_pointer(self, typ, count, value_offset):
+        if typ not in {TIFF_LONG, TIFF_IFD} or count != 1:
+            raise UnsupportedLayout("Expected an IFD pointer")
+        return self.unpack("I", value_offset)[0]
+
+
+def iter_exif_entries(tiff):
+    """Yield (tag_name, tag, type, count, value_offset) for the entries of IFD0 and the Exif IFD.
+
+    tag_name is None for the entries that aren't of interest.
+    """
+    exif_ifd_offset = None
+    for tag, typ, count, value_offset in tiff.iter_ifd(tiff.ifd0_offset):
+        if tag == EXIF_IFD_POINTER:
+            exif_ifd_offset = tiff.read_pointer(typ, count, value_offset)
+        yield EXIF_IFD0_TAGS.get(tag), tag, typ, count, value_offset
+
+    if exif_ifd_offset is not None:
+        for tag, typ, count, value_offset in tiff.iter_ifd(exif_ifd_offset):
+            yield EXIF_PHOTO_TAGS.get(tag), tag, typ, count, value_offset
+
+
+def read_exif(data, start, end, result):
+    tiff = TiffReader(data[start:end], len(EXIF_HEADER))
+    seen = set()
+    for tag_name, tag, typ, count, value_offset in iter_exif_entries(tiff):
+        if tag_name is None:
+            if tag in EXIF_PHOTO_SUBSEC_TAGS:
+                raise UnsupportedLayout("Sub-second EXIF timestamps")
+            continue
+        if tag_name in seen:
+            raise UnsupportedLayout(f"Repeated {tag_name}")
+        seen.add(tag_name)
+        if tag_name == "Exif.Image.Model":
+            result[tag_name] = tiff.read_ascii(typ, count, value_offset)
+        elif tag_name == "Exif.Image.TimeZoneOffset":
+            result[tag_name] = tiff.read_sshort(typ, count, value_offset)
+        else:
+            result[tag_name] = tiff.read_datetime(typ, count, value_offset)
+
+
+def parse_xmp_datetime(text):
+    match = XMP_DATETIME_RE.fullmatch(text)
+    if not match:
+        raise UnsupportedLayout("Unusual XMP date")
+    year, month, day, hours, minutes, seconds, fraction, offset = match.groups()
+    microsecond = round(float(fraction) * 10**6) if fraction else 0
+    if offset in {None, b"Z"}:
+        tz = datetime.timezone.utc
+    else:
+        sign = -1 if offset[:1] == b"-" else 1
+        tz = datetime.timezone(sign * datetime.timedelta(hours=int(offset[1:3]), minutes=int(offset[4:6])))
+    try:
+        return datetime.datetime(
+            int(year), int(month), int(day), int(hours), int(minutes), int(seconds), min(microsecond, 999999), tz
+        )
+    except ValueError:
+        raise UnsupportedLayout("Invalid XMP date")
+
+
+def read_xmp(data, start, end, result):
+    packet = data[start + len(XMP_HEADER):end]
+    for tag_name, qualified_name in XMP_TAGS.items():
+        if qualified_name not in packet:
+            continue
+        match = (
+            re.search(rb'\s' + qualified_name + rb'\s*=\s*"([^"]*)"', packet)
+            or re.search(rb'<' + qualified_name + rb'>([^<]*)</' + qualified_name + rb'>', packet)
+        )
+        if match is None:
+            raise UnsupportedLayout("Unusual XMP layout")
+        result[tag_name] = parse_xmp_datetime(match.group(1).strip())
+
+
+def iter_iptc_datasets(data):
+    pos = 0
+    while pos < len(data) and data[pos] == 0x1c:
+        record, dataset, size = struct.unpack_from(">BBH", data, pos + 1)
+        if size & 0x8000:
+            raise UnsupportedLayout("Extended IPTC dataset")
+        yield record, dataset, data[pos + 5:pos + 5 + size]
+        pos += 5 + size
+
+
+def read_iptc(data, start, end, result):
+    data = data[start + len(PHOTOSHOP_HEADER):end]
+    pos = 0
+    iptc = None
+    while pos + 12 <= len(data) and data[pos:pos + 4] == b"8BIM":
+        resource_id, = struct.unpack_from(">H", data, pos + 4)
+        name_length = data[pos + 6]
+        pos += 6 + name_length + 1 + (name_length + 1) % 2
+        size, = struct.unpack_from(">I", data, pos)
+        pos += 4
+        if resource_id == 0x0404:
+            iptc = data[pos:pos + size]
+        pos += size + size % 2
+    if iptc is None:
+        return
+
+    values = {}
+    for record, dataset, value in iter_iptc_datasets(iptc):
+        if record == 2:
+            if dataset in values:
+                raise UnsupportedLayout("Repeated IPTC dataset")
+            values[dataset] = value
+
+    for tag_name, (date_dataset, time_dataset) in IPTC_TAGS.items():
+        date_value = values.get(date_dataset)
+        time_value = values.get(time_dataset)
+        if date_value is None or time_value is None:
+            continue
+        try:
+            date = datetime.datetime.strptime(date_value.decode("ascii"), "%Y%m%d")
+            time = datetime.datetime.strptime(time_value.decode("ascii"), "%H%M%S%z")
+        except (ValueError, UnicodeDecodeError):
+            raise UnsupportedLayout("Unusual IPTC date/time")
+        result[tag_name] = datetime.datetime.combine(date.date(), time.timetz())
+
+
+def read_tags(path):
+    """Read the timestamp tags of a JPEG file.
+
+    Returns a dict keyed by the pyexiv2 tag names, or None if the file isn't a JPEG
+    or is laid out in a way this reader doesn't handle.
+    """
+    try:
+        with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            if data[:2] != b"\xff\xd8":
+                return None
+            result = {}
+            seen = set()
+            for marker, start, end in iter_segments(data):
+                if marker == 0xe1 and data[start:start + len(EXIF_HEADER)] == EXIF_HEADER:
+                    kind, read = "exif", read_exif
+                elif marker == 0xe1 and data[start:start + len(XMP_HEADER)] == XMP_HEADER:
+                    kind, read = "xmp", read_xmp
+                elif marker == 0xed and data[start:start + len(PHOTOSHOP_HEADER)] == PHOTOSHOP_HEADER:
+                    kind, read = "iptc", read_iptc
+                else:
+                    continue
+                if kind in seen:
+                    raise UnsupportedLayout(f"Multiple {kind} segments")
+                seen.add(kind)
+                read(data, start, end, result)
+            return result
+    except (UnsupportedLayout, struct.error, IndexError, ValueError, OSError):
+        return None
+
+
+def open_exif(data):
+    """Return a TiffReader over the EXIF data of a JPEG or TIFF-based file."""
+    if data[:4] in {b"II*\0", b"MM\0*"}:
+        return TiffReader(data)
+    exif_start = None
+    for marker, start, end in iter_segments(data):
+        if marker == 0xe1 and data[start:start + len(EXIF_HEADER)] == EXIF_HEADER:
+            if exif_start is not None:
+                raise UnsupportedLayout("Multiple exif segments")
+            exif_start = start
+    if exif_start is None:
+        raise UnsupportedLayout("No EXIF data")
+    return TiffReader(data, exif_start + len(EXIF_HEADER))
+
+
+def locate_exif_values(tiff):
+    """Map each tag name of interest to the (absolute offset, type, count) of its value."""
+    locations = {}
+    for tag_name, tag, typ, count, value_offset in iter_exif_entries(tiff):
+        if tag_name is None:
+            continue
+        if tag_name in locations:
+            raise UnsupportedLayout(f"Repeated {tag_name}")
+        if TIFF_TYPE_SIZES.get(typ, 0) * count > 4:
+            value_offset, = tiff.unpack("I", value_offset)
+        locations[tag_name] = tiff.base + value_offset, typ, count
+    return locations
+
+
+def encode_exif_value(tiff, tag_name, value, typ, count):
+    if tag_name == "Exif.Image.TimeZoneOffset":
+        if typ != TIFF_SSHORT or count != 1:
+            raise UnsupportedLayout("Expected a single SSHORT value")
+        return struct.pack(tiff.endian + "h", value)
+    encoded = value.strftime("%Y:%m:%d %H:%M:%S").encode("ascii") + b"\0"
+    if typ != TIFF_ASCII or len(encoded) != count:
+        raise UnsupportedLayout(f"{tag_name} has an unexpected size")
+    return encoded
+
+
+def write_exif_tags(path, values):
+    """Overwrite existing EXIF timestamps (and TimeZoneOffset) of a JPEG or TIFF-based file in place.
+
+    values maps tag names to datetimes, or to an int for Exif.Image.TimeZoneOffset. This
+    only touches the bytes of those values, so every tag must already be present with the
+    same type and size. The values are read back afterwards, and VerificationError is
+    raised if they don't match. Returns False, without touching the file, if the tags
+    can't be patched in place.
+    """
+    try:
+        with open(path, "r+b") as f, mmap.mmap(f.fileno(), 0) as data:
+            tiff = open_exif(data)
+            locations = locate_exif_values(tiff)
+            patches = []
+            for tag_name, value in values.items():
+                if tag_name not in locations:
+                    raise UnsupportedLayout(f"No existing {tag_name}")
+                offset, typ, count = locations[tag_name]
+                patches.append((offset, encode_exif_value(tiff, tag_name, value, typ, count)))
+            for offset, encoded in patches:
+                data[offset:offset + len(encoded)] = encoded
+            data.flush()
+    except (UnsupportedLayout, struct.error, IndexError, ValueError, UnicodeEncodeError):
+        return False
+
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        locations = locate_exif_values(open_exif(data))
+        for (offset, encoded), tag_name in zip(patches, values):
+            if locations[tag_name][0] != offset or data[offset:offset + len(encoded)] != encoded:
+                raise VerificationError(f"{path}: {tag_name} did not read back as written")
+    return True
+
+
+def main():
+    for path in sys.argv[1:]:
+        print(f"{path}: {read_tags(path)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,26 +2,37 @@
 
 import gi
 gi.require_version('Gtk', '3.0')
-from gi.repository import Gtk, GObject, GdkPixbuf
+from gi.repository import Gtk, GObject, GLib, GdkPixbuf
 import gbulb
 gbulb.install(gtk=True)
 
 import os
+import stat
+import array
 import io
 import cv2
+import numpy as np
 import sys
-import re
 import asyncio
+import itertools
 import contextlib
-import subprocess
+import collections
+import concurrent.futures
 import aiofiles
-import pyexiv2
 import datetime
 import pytimeparse
 import tempfile
-import functools
 import sortedcontainers
+import columnar_store
+import delta_anchors
 import mpl_extract
+import exiftool_pool
+import reader_pool
+import metadata_cache
+import file_types
+import format_handlers
+import metadata_reader
+from metadata_reader import ALL_TAGS
 
 PROJECT_ROOT = os.path.dirname(os.path.realpath(__file__))
 
@@ -34,22 +45,6 @@ def make_null_task():
     return asyncio.create_task(coro())
 
 
-def store_set_pyobject_sort_func(store, column):
-    def sort_func(treemodel, it1, it2, user_data):
-        val1 = treemodel.get_value(it1, column)
-        val2 = treemodel.get_value(it2, column)
-        if val1 is None:
-            if val2 is None:
-                return 0
-            else:
-                return -1
-        elif val2 is None:
-            return 1
-        return (val1 > val2) - (val1 < val2)
-
-    store.set_sort_func(column, sort_func)
-
-
 def make_pyobject_column(caption, idx, **kwargs):
     renderer = Gtk.CellRendererText()
     col = Gtk.TreeViewColumn(caption, renderer, **kwargs)
@@ -86,13 +81,6 @@ def str_to_datetime_delta(text):
     return datetime.timedelta(seconds=seconds)
 
 
-def round_datetime_to_second(ts):
-    if ts.microsecond >= 500000:
-        return ts.replace(microsecond=0) + datetime.timedelta(seconds=1)
-    else:
-        return ts.replace(microsecond=0)
-
-
 class AsyncBytesIO:
     def __init__(self, *args):
         self.inner = io.BytesIO(*args)
@@ -115,81 +103,242 @@ class RowSelection:
             yield self.files[s]
 
 
-EXIF_TIMESTAMP_TAGS = (
-    "Exif.Image.DateTime",
-    "Exif.Photo.DateTimeOriginal",
-    "Exif.Photo.DateTimeDigitized",
-    "Exif.Image.DateTimeOriginal",
-    "Exif.Image.PreviewDateTime",
-)
-EXIF_TAGS = (
-    "Exif.Image.Model",
-    "Exif.Image.TimeZoneOffset",
-) + EXIF_TIMESTAMP_TAGS
-
-XMP_TIMESTAMP_TAGS = (
-    "Xmp.xmp.CreateDate",
-    "Xmp.photoshop.DateCreated",
-)
-XMP_TAGS = XMP_TIMESTAMP_TAGS
-
-IPTC_TIMESTAMP_TAGS = (
-    ("Iptc.Application2.DateCreated", "Iptc.Application2.TimeCreated"),
-    ("Iptc.Application2.DigitizationDate", "Iptc.Application2.DigitizationTime"),
-)
-IPTC_TAGS = IPTC_TIMESTAMP_TAGS
-
-QUICKTIME_TIMESTAMP_TAGS = (
-    "Quicktime:CreateDate",
-    "Quicktime:ModifyDate",
-    "Quicktime:TrackCreateDate",
-    "Quicktime:TrackModifyDate",
-    "Quicktime:MediaCreateDate",
-    "Quicktime:MediaModifyDate",
-)
-QUICKTIME_TAGS = QUICKTIME_TIMESTAMP_TAGS
-
-NIKON_TAGS = (
-    "Nikon:TimeZone",
-    "Nikon:DaylightSavings",
-)
-
-AVCHD_TAGS = (
-    "AVCHD:Timestamp",
-)
-
-ALL_TAGS = EXIF_TAGS + XMP_TAGS + IPTC_TAGS + QUICKTIME_TAGS + NIKON_TAGS + AVCHD_TAGS
+CACHE_WRITE_BATCH_SIZE = 500
 
+# Above this many selected rows, only the visible ones are loaded first
+MAX_PRIORITISED_SELECTED_ROWS = 200
+
+# Directories listed at once by populate; many, since on network filesystems each listing
+# is mostly spent waiting on the server
+WALK_THREADS = 16
+POPULATE_BATCH_SIZE = 1000
+
+# Rows updated between yields to the UI when the anchors change
+DELTA_UPDATE_BATCH_SIZE = 2000
+
+# How long after values of the sort column change the rows are resorted, so that e.g. a
+# reload doesn't resort them for every row
+RESORT_DELAY_MS = 500
+
+ROW_COLOUR = "#ffffff"
+# The background of rows that are anchors, i.e. whose delta was set by hand
+ANCHOR_ROW_COLOUR = "#ffff00"
+
+ROW_STATE_QUEUED = "Queued"
+ROW_STATE_READING = "Reading"
+ROW_STATE_WRITING = "Writing"
+ROW_STATE_SAVED = "Saved"
+BUSY_ROW_STATES = {ROW_STATE_QUEUED, ROW_STATE_READING, ROW_STATE_WRITING}
 
-class FileStore:
-    class _Row:
-        INDICES = {}
-        INDICES["full_path"] = (len(INDICES), GObject.TYPE_STRING)
-        INDICES["shortened_path"] = (len(INDICES), GObject.TYPE_STRING)
-        INDICES["timestamp"] = (len(INDICES), GObject.TYPE_PYOBJECT)
-        INDICES["delta"] = (len(INDICES), GObject.TYPE_PYOBJECT)
-        INDICES["mtime"] = (len(INDICES), GObject.TYPE_PYOBJECT)
-        INDICES["row-bg-colour"] = (len(INDICES), GObject.TYPE_STRING)
-        for t in ALL_TAGS:
-            INDICES[t] = (len(INDICES), GObject.TYPE_PYOBJECT)
 
-        def __init__(self, store, it):
-            self.store = store
-            self.it = it
+class LoadQueue:
+    """Rows waiting to be loaded.
 
-        def get_value(self, column_index):
-            return self.store.get_value(self.it, column_index)
+    Rows are taken in store order, except that prioritise() moves the given rows
+    (e.g. the visible and selected ones) to the front.
+    """
 
-        def set_value(self, column_index, value):
-            return self.store.set_value(self.it, column_index, value)
+    def __init__(self, rows):
+        self.pending = {row["full_path"]: row for row in rows}
+        self.in_order = collections.deque(self.pending)
+        self.urgent = collections.deque()
+
+    def __len__(self):
+        return len(self.pending)
+
+    def prioritise(self, rows):
+        self.urgent = collections.deque(row["full_path"] for row in rows if row["full_path"] in self.pending)
+
+    def pop(self):
+        """Return the next row to load, and whether it was prioritised, or (None, False) when empty."""
+        for paths, urgent in ((self.urgent, True), (self.in_order, False)):
+            while paths:
+                row = self.pending.pop(paths.popleft(), None)
+                if row is not None:
+                    return row, urgent
+        return None, False
+
+
+class FileTreeModel(GObject.Object, Gtk.TreeModel, Gtk.TreeSortable):
+    """A list model that serves the values of a FileStore's rows straight from its columnar store.
+
+    Nothing is copied into the model, so it costs one row id per row. Iters hold their
+    row's id, plus one as an iter can't hold 0, and so stay valid as rows are added and
+    sorted. Sorting is done by the columnar store, and applied to the view as a single
+    reordering; rows are resorted shortly after values of the sort column change.
+    """
+
+    def __init__(self, columns, indices):
+        super().__init__()
+        self.columns = columns
+        self.fields = list(indices)
+        self.types = [typ for i, typ in indices.values()]
+        # The row id at each position
+        self.order = array.array("q")
+        # The position of each row id, rebuilt after rows are added or sorted
+        self.positions = None
+        self.sort_column_id = Gtk.TREE_SORTABLE_UNSORTED_SORT_COLUMN_ID
+        self.sort_type = Gtk.SortType.ASCENDING
+        self.resort_source = None
+
+    def iter_of(self, i):
+        it = Gtk.TreeIter()
+        it.user_data = i + 1
+        return it
+
+    def position_of(self, i):
+        if self.positions is None:
+            self.positions = np.empty(len(self.order), dtype=np.intp)
+            self.positions[np.array(self.order, dtype=np.intp)] = np.arange(len(self.order))
+        return int(self.positions[i])
+
+    def insert_many(self, rows):
+        """Insert rows, given as (position, row id) pairs in increasing order of position.
+
+        Each position is where the row ends up once they're all inserted. The order is
+        rebuilt once for the whole batch, and then the view is told about the rows in
+        order, so that the rows before each one it's told about are already right.
+        """
+        if not rows:
+            return
+        new_positions = np.array([pos for pos, i in rows], dtype=np.intp)
+        order = np.empty(len(self.order) + len(rows), dtype=np.int64)
+        is_old = np.ones(len(order), dtype=bool)
+        is_old[new_positions] = False
+        order[new_positions] = [i for pos, i in rows]
+        order[is_old] = np.array(self.order, dtype=np.int64)
+        self.order = array.array("q", order.tobytes())
+        self.positions = None
+        for pos, i in rows:
+            self.row_inserted(Gtk.TreePath(pos), self.iter_of(i))
+
+    def notify_row_changed(self, i, fields):
+        self.row_changed(Gtk.TreePath(self.position_of(i)), self.iter_of(i))
+        if self.sort_column_id >= 0 and self.fields[self.sort_column_id] in fields and self.resort_source is None:
+            self.resort_source = GLib.timeout_add(RESORT_DELAY_MS, self.sort)
+
+    def sort(self):
+        """Put the rows in order of the sort column, if there is one."""
+        if self.resort_source is not None:
+            GLib.source_remove(self.resort_source)
+            self.resort_source = None
+        if self.sort_column_id < 0 or len(self.order) == 0:
+            return False
+        ids = np.array(self.order, dtype=np.intp)
+        new_order = self.columns.sort_order(self.fields[self.sort_column_id], ids)
+        if self.sort_type == Gtk.SortType.DESCENDING:
+            new_order = new_order[::-1]
+        self.order = array.array("q", ids[new_order].astype(np.int64).tobytes())
+        self.positions = None
+        self.rows_reordered(Gtk.TreePath(), None, new_order.tolist())
+        return False
+
+    def do_get_sort_column_id(self):
+        return self.sort_column_id >= 0, self.sort_column_id, self.sort_type
+
+    def do_set_sort_column_id(self, sort_column_id, order):
+        if (sort_column_id, order) != (self.sort_column_id, self.sort_type):
+            self.sort_column_id = sort_column_id
+            self.sort_type = order
+            self.sort_column_changed()
+            self.sort()
+
+    def do_has_default_sort_func(self):
+        return False
+
+    def do_get_flags(self):
+        return Gtk.TreeModelFlags.LIST_ONLY | Gtk.TreeModelFlags.ITERS_PERSIST
+
+    def do_get_n_columns(self):
+        return len(self.types)
+
+    def do_get_column_type(self, column):
+        return self.types[column]
+
+    def do_get_iter(self, path):
+        pos, = path.get_indices()
+        if pos < len(self.order):
+            return True, self.iter_of(self.order[pos])
+        return False, None
+
+    def do_get_path(self, it):
+        return Gtk.TreePath(self.position_of(it.user_data - 1))
+
+    def do_get_value(self, it, column):
+        i = it.user_data - 1
+        field = self.fields[column]
+        if field == "id":
+            return i
+        return self.columns.get(i, field)
+
+    def do_iter_next(self, it):
+        pos = self.position_of(it.user_data - 1) + 1
+        if pos < len(self.order):
+            return True, self.iter_of(self.order[pos])
+        return False, None
+
+    def do_iter_previous(self, it):
+        pos = self.position_of(it.user_data - 1) - 1
+        if pos >= 0:
+            return True, self.iter_of(self.order[pos])
+        return False, None
+
+    def do_iter_children(self, parent):
+        return self.do_iter_nth_child(parent, 0)
+
+    def do_iter_has_child(self, it):
+        return False
+
+    def do_iter_n_children(self, it):
+        return len(self.order) if it is None else 0
+
+    def do_iter_nth_child(self, parent, n):
+        if parent is None and n < len(self.order):
+            return True, self.iter_of(self.order[n])
+        return False, None
+
+    def do_iter_parent(self, child):
+        return False, None
+
+
+class FileStore:
+    # Every field of a row, all kept in the columnar store
+    FIELDS = (
+        "full_path", "shortened_path", "timestamp", "delta", "mtime", "row-bg-colour", "state", "stat", "handler",
+        format_handlers.TIMEZONE_OFFSET_GUESSED, *ALL_TAGS,
+    )
+
+    # The columns of the tree model, which are the fields that are shown along with the id
+    # of each row in the columnar store
+    INDICES = {}
+    INDICES["id"] = (len(INDICES), GObject.TYPE_INT)
+    INDICES["shortened_path"] = (len(INDICES), GObject.TYPE_STRING)
+    INDICES["timestamp"] = (len(INDICES), GObject.TYPE_PYOBJECT)
+    INDICES["delta"] = (len(INDICES), GObject.TYPE_PYOBJECT)
+    INDICES["mtime"] = (len(INDICES), GObject.TYPE_PYOBJECT)
+    INDICES["row-bg-colour"] = (len(INDICES), GObject.TYPE_STRING)
+    INDICES["state"] = (len(INDICES), GObject.TYPE_STRING)
+    for t in ALL_TAGS:
+        INDICES[t] = (len(INDICES), GObject.TYPE_PYOBJECT)
+
+    class _Row:
+        def __init__(self, files, i):
+            self.files = files
+            self.id = i
 
         def __getitem__(self, field):
-            i = self.INDICES[field][0]
-            return self.get_value(i)
+            return self.files.columns.get(self.id, field)
 
         def __setitem__(self, field, value):
-            i = self.INDICES[field][0]
-            return self.set_value(i, value)
+            self.update({field: value})
+
+        def update(self, values):
+            """Set several fields at once, e.g. {"delta": ..., "row-bg-colour": ...}."""
+            self.files.set_row_values(self.id, values)
+
+        @property
+        def is_busy(self):
+            return self["state"] in BUSY_ROW_STATES
 
         def get_exif_aware_timestamp(self, tag_name):
             ts = self[tag_name]
@@ -198,105 +347,108 @@ class FileStore:
             tz_offset = self["Exif.Image.TimeZoneOffset"]
             return ts.replace(tzinfo=datetime.timezone(datetime.timedelta(hours=tz_offset)))
 
-        def iter_exiv_timestamps(self):
-            for tag_name in XMP_TIMESTAMP_TAGS + IPTC_TIMESTAMP_TAGS:
-                yield tag_name, self[tag_name]
-            for tag_name in EXIF_TIMESTAMP_TAGS:
-                yield tag_name, self.get_exif_aware_timestamp(tag_name)
-
-    def __init__(self):
-        self.store = Gtk.ListStore(*(t for i, t in self._Row.INDICES.values()))
+    def __init__(self, max_files_in_flight=None, use_process_pool=False):
+        self.columns = columnar_store.ColumnarStore(
+            self.FIELDS,
+            timestamp_fields=("timestamp", "mtime"),
+            delta_fields=("delta",),
+            interned_fields=("row-bg-colour", "state"),
+            sparse_fields=ALL_TAGS,
+        )
+        self.store = FileTreeModel(self.columns, self.INDICES)
         self.avchd_dirs = []
-
-        for idx, typ in self._Row.INDICES.values():
-            if typ is GObject.TYPE_PYOBJECT:
-                store_set_pyobject_sort_func(self.store, idx)
-
-    def Row(self, it):
-        return self._Row(self.store, it)
+        # The MplDirectory of each clip in avchd_dirs, by absolute STREAM path
+        self.avchd_clips = {}
+        self.max_files_in_flight = max_files_in_flight or os.cpu_count() or 1
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.max_files_in_flight)
+        self.process_pool = reader_pool.ReaderPool(self.max_files_in_flight) if use_process_pool else None
+        self.exiftool = exiftool_pool.ExiftoolPool(size=self.max_files_in_flight)
+        self.metadata_cache = metadata_cache.MetadataCache()
+        self.load_queue = None
+        self.timestamp_index = delta_anchors.TimestampIndex()
+
+    def Row(self, i):
+        return self._Row(self, i)
 
     @classmethod
     def idx(cls, name):
-        return cls._Row.INDICES[name][0]
-
-    @staticmethod
-    def get_exiv_metadata(f):
-        metadata = pyexiv2.ImageMetadata(f)
-        try:
-            metadata.read()
-        except:
-            return None
+        return cls.INDICES[name][0]
+
+    def set_row_values(self, i, values):
+        """Set fields of row i, telling the view about it only if any that are shown changed."""
+        changed = [field for field, value in values.items() if self.columns.set(i, field, value) and field in self.INDICES]
+        if changed:
+            self.store.notify_row_changed(i, changed)
+
+    def set_deltas(self, ids, deltas, is_anchor):
+        """Set the deltas, in seconds, and background colours of an array of row ids at once.
+
+        Only the rows whose values changed are redrawn.
+        """
+        colours = [ANCHOR_ROW_COLOUR if anchor else ROW_COLOUR for anchor in is_anchor.tolist()]
+        changed = self.columns.set_seconds("delta", ids, deltas)
+        changed |= self.columns.set_many("row-bg-colour", ids, colours)
+        for i in ids[changed].tolist():
+            self.store.notify_row_changed(i, ("delta", "row-bg-colour"))
+
+    def read_file_tags(self, f, st=None):
+        """Read everything needed for one row that its format handler can read file by file.
+
+        st is the file's FileStat if it's already known to be current. Returns the
+        FileStat, the file's sniffed type, its format handler, its tags, whether they
+        came from the metadata cache, and whether the file still has to go through the handler's
+        read_many, which is done in batches. Runs in a worker thread, so must not touch
+        the store.
+        """
+        if st is None:
+            st = metadata_cache.file_stat(os.stat(f))
+        # The file's type only depends on its contents, so is cached, but its handler also
+        # depends on where it is, e.g. whether it's in one of avchd_dirs, so is always found
+        # afresh. Cached tags are only used if they were read by the same handler
+        cached = self.metadata_cache.get(metadata_cache.MetadataCache.key_of(st))
+        file_type = file_types.sniff(f) if cached is None else cached[1]
+        handler = format_handlers.find_handler(self, f, file_type)
+        from_cache = cached is not None and cached[0] == handler.name
+        incomplete = False
+        if from_cache:
+            result = cached[2]
         else:
-            return metadata
-
-    async def reload(self, app, selected_rows=None):
-        SENTINEL = object()
+            if self.process_pool is None:
+                record, incomplete = metadata_reader.read_tags(handler, f, file_type)
+            else:
+                record, incomplete = self.process_pool.read_tags(handler, f, file_type)
+            result = metadata_reader.record_to_tags(record)
+        result["mtime"] = datetime.datetime.fromtimestamp(st.mtime_ns / 1e9, datetime.timezone(DEFAULT_TIMEZONE_OFFSET))
+        return st, file_type, handler, result, from_cache, incomplete
+
+    def index_avchd_dirs(self):
+        """Rebuild avchd_clips, once avchd_dirs have been read."""
+        self.avchd_clips = {
+            stream_path: avchd_db
+            for avchd_db in self.avchd_dirs
+            for stream_path in avchd_db.clips
+        }
+
+    def find_avchd_dir(self, f):
+        return self.avchd_clips.get(f)
+
+    def prioritise(self, rows):
+        if self.load_queue is not None:
+            self.load_queue.prioritise(rows)
+
+    async def reload(self, app, selected_rows=None, stop=None, loaded_state=None, restat=True):
+        """Read the files of the given rows, yielding the fraction done as it goes.
+
+        Stops between files once the stop event is set. Each row is marked as queued and
+        then reading until it's done, when its state becomes loaded_state. With
+        restat=False, the FileStats that populate stored on the rows are trusted
+        instead of statting every file again.
+        """
         loop = asyncio.get_running_loop()
 
         if selected_rows is None:
             selected_rows = self
 
-        def get_mtime(f):
-            return datetime.datetime.fromtimestamp(os.path.getmtime(f), datetime.timezone(DEFAULT_TIMEZONE_OFFSET))
-
-        def get_quicktime_tags(f):
-            result = []
-            proc = subprocess.run(
-                ['exiftool', '-s', file] + ['-'+t for t in QUICKTIME_TAGS + NIKON_TAGS],
-                capture_output=True,
-            )
-            if proc.returncode == 0:
-                for line in proc.stdout.splitlines():
-                    line = line.decode('utf8')
-                    tag_suffix, value = (s.strip() for s in line.split(':', 1))
-                    for prefix, group in [
-                        ("Quicktime", QUICKTIME_TAGS),
-                        ("Nikon", NIKON_TAGS),
-                    ]:
-                        tag_name = f"{prefix}:{tag_suffix}"
-                        if tag_name in group:
-                            break
-                    else:
-                        raise AssertionError(f"Unknown tag: {tag_name}")
-                    if tag_name in QUICKTIME_TIMESTAMP_TAGS:
-                        value = datetime.datetime.strptime(value, "%Y:%m:%d %H:%M:%S").replace(
-                            tzinfo=datetime.timezone(datetime.timedelta())
-                        )
-                    result.append((tag_name, value))
-            return result
-
-        def guess_timezone_offset(row, tag_name):
-            for reference_tag in ("Xmp.xmp.CreateDate",):
-                reference_dt = row[reference_tag]
-                if reference_dt is not None:
-                    break
-            else:
-                return 0
-            naive_dt = row[tag_name].replace(tzinfo=datetime.timezone(datetime.timedelta()))
-            diff = naive_dt - reference_dt
-            tzoffset = guess_timezone_offset.result = round(diff.total_seconds() / 60**2)
-            # new_diff_seconds = (naive_dt.replace(tzinfo=datetime.timezone(datetime.timedelta(hours=tzoffset))) - reference_dt).total_seconds()
-            # app.notify(
-            #     f"Inferred capture timezone of {tzoffset:+d} hours",
-            #     f"This synchronizes the timestamp with the {reference_tag} with a difference of {new_diff_seconds} seconds. "
-            #     "If this difference is more than a few seconds, the results might be unexpected. "
-            #     "If any updates are saved, the new timezone will be written into the tags."
-            # )
-            return tzoffset
-
-        async def try_other_tag_sources(row, f):
-            if f.endswith(".MTS"):
-                for avchd_db in self.avchd_dirs:
-                    if f.startswith(avchd_db.path):
-                        row["AVCHD:Timestamp"] = ts = avchd_db.get_mts(os.path.basename(f))["datetime"]
-                        if ts.tzinfo is None:
-                            offset = guess_timezone_offset(row, "AVCHD:Timestamp")
-                            row["AVCHD:Timestamp"] = ts.replace(tzinfo=datetime.timezone(datetime.timedelta(hours=offset)))
-                        return
-
-            for tag_name, timestamp in await loop.run_in_executor(None, get_quicktime_tags, f):
-                row[tag_name] = timestamp
-
         def get_timestamp(r):
             def tries():
                 yield r.get_exif_aware_timestamp("Exif.Photo.DateTimeOriginal")
@@ -306,67 +458,53 @@ class FileStore:
 
             return next((t for t in tries() if t is not None), None)
 
-        for avchd_db in self.avchd_dirs:
-            await loop.run_in_executor(None, avchd_db.read)
-
-        for i, row in enumerate(selected_rows):
-            yield i / len(selected_rows)
-            file = row["full_path"]
-            row["delta"] = app.current_timestamp_delta
-            row["mtime"] = await loop.run_in_executor(None, get_mtime, file)
-            row["row-bg-colour"] = "#ffffff"
-
-            metadata = await loop.run_in_executor(None, self.get_exiv_metadata, file)
-
-            if metadata is None:
-                for tag_name in XMP_TAGS + EXIF_TAGS + IPTC_TAGS:
-                    row[tag_name] = None
-            else:
-                for tag_name in XMP_TAGS:
-                    tag = metadata.get(tag_name, SENTINEL)
-                    if tag is not SENTINEL:
-                        try:
-                            row[tag_name] = tag.value
-                        except pyexiv2.xmp.XmpValueError:
-                            match = re.fullmatch(r'(\d+)-(\d+)-(\d+)T(\d+):(\d+):(\d+\.?\d*)((?:[+-]\d+:\d+)?)', tag.raw_value)
-                            if match:
-                                year, month, day, hours, minutes, seconds, offset = match.groups()
-                                if not offset:
-                                    offset = "+00:00"
-                                tag.raw_value = f"{year}-{month}-{day}T{hours}:{minutes}:{float(seconds):09.6f}{offset}"
-                                row[tag_name] = tag.value
-                            else:
-                                raise
-
-                for tag_name in EXIF_TAGS:
-                    tag = metadata.get(tag_name, SENTINEL)
-                    if tag is not SENTINEL:
-                        row[tag_name] = tag.value
-                assert SENTINEL is metadata.get("Exif.Photo.SubSecTime", SENTINEL)
-                assert SENTINEL is metadata.get("Exif.Photo.SubSecTimeOriginal", SENTINEL)
-                assert SENTINEL is metadata.get("Exif.Photo.SubSecTimeDigitized", SENTINEL)
-
-                for tag_name in IPTC_TAGS:
-                    if isinstance(tag_name, tuple):
-                         date_tag_name, time_tag_name = tag_name
-                         date_tag = metadata.get(date_tag_name, SENTINEL)
-                         time_tag = metadata.get(time_tag_name, SENTINEL)
-                         if date_tag is not SENTINEL and time_tag is not SENTINEL:
-                            assert len(date_tag.value) == 1
-                            assert len(time_tag.value) == 1
-                            row[tag_name] = datetime.datetime.combine(date_tag.value[0], time_tag.value[0])
-                    else:
-                        tag = metadata.get(tag_name, SENTINEL)
-                        if tag is not SENTINEL:
-                            row[tag_name] = tag.value
-
-            if row["Exif.Photo.DateTimeOriginal"] is not None and row["Exif.Image.TimeZoneOffset"] is None:
-                row["Exif.Image.TimeZoneOffset"] = guess_timezone_offset(row, "Exif.Photo.DateTimeOriginal")
-
-            if row["Exif.Photo.DateTimeOriginal"] is None:
-                await try_other_tag_sources(row, file)
+        def stopped():
+            return stop is not None and stop.is_set()
+
+        def submit_next():
+            if stopped():
+                return
+            row, urgent = self.load_queue.pop()
+            if row is not None:
+                row["state"] = ROW_STATE_READING
+                st = None if restat else row["stat"]
+                future = loop.run_in_executor(self.executor, self.read_file_tags, row["full_path"], st)
+                in_flight.append((row, urgent, future))
+
+        def submit_batch(handler):
+            batch = incomplete_batches.pop(handler)
+            files = [row["full_path"] for row, _, _ in batch]
+            future = loop.run_in_executor(self.executor, handler.read_many, self, files)
+            batches_in_flight.append((handler, batch, future))
+
+        def store_in_cache(st, file_type, handler, tags):
+            if handler.cacheable:
+                cache_key = metadata_cache.MetadataCache.key_of(st)
+                cache_writes.append((cache_key, (handler.name, file_type, {t: tags[t] for t in ALL_TAGS if t in tags})))
+
+        async def flush_cache_writes():
+            if cache_writes:
+                await loop.run_in_executor(self.executor, self.metadata_cache.put_many, list(cache_writes))
+                cache_writes.clear()
+
+        def apply_tags(row, handler, tags):
+            row.update({
+                "handler": handler,
+                "mtime": tags["mtime"],
+                **{tag_name: tags.get(tag_name) for tag_name in ALL_TAGS},
+            })
+
+            format_handlers.fill_in_exif_timezone_offset(row)
+
+            ts = row["AVCHD:Timestamp"]
+            if ts is not None and ts.tzinfo is None:
+                offset = format_handlers.guess_timezone_offset(row, "AVCHD:Timestamp")
+                row["AVCHD:Timestamp"] = ts.replace(tzinfo=datetime.timezone(datetime.timedelta(hours=offset)))
 
             row["timestamp"] = get_timestamp(row)
+            self.timestamp_index.set(row, row["timestamp"])
+            row["state"] = loaded_state
+            app.on_row_loaded(row)
 
             # for tag in (
             #     "Xmp.photoshop.DateCreated",
@@ -376,128 +514,265 @@ class FileStore:
             #     if row[tag] is not None:
             #         row[tag] = row["Xmp.xmp.CreateDate"]
 
+        async def finish_batch():
+            handler, batch, future = batches_in_flight[0]
+            results = await future
+            batches_in_flight.popleft()
+            for (row, st, file_type, tags), more_tags in zip(batch, results):
+                tags.update(more_tags)
+                store_in_cache(st, file_type, handler, tags)
+                apply_tags(row, handler, tags)
+            return len(batch)
+
+        for handler in format_handlers.HANDLERS.values():
+            await loop.run_in_executor(None, handler.prepare_reads, self)
+
+        # Keep up to max_files_in_flight files being read by the executor at once, taking
+        # them from the load queue (which the caller can reprioritise while this runs) and
+        # their results in order. Files that their handler has to finish reading with
+        # read_many are set aside and sent to it in batches, unless they were prioritised.
+        self.load_queue = LoadQueue(selected_rows)
+        n_rows = len(self.load_queue)
+        for row in self.load_queue.pending.values():
+            row["state"] = ROW_STATE_QUEUED
+        in_flight = collections.deque()
+        incomplete_batches = {}
+        batches_in_flight = collections.deque()
+        cache_writes = []
+        n_done = 0
+
+        try:
+            yield 0
+            for _ in range(self.max_files_in_flight):
+                submit_next()
+            while in_flight and not stopped():
+                row, urgent, future = in_flight[0]
+                st, file_type, handler, tags, from_cache, incomplete = await future
+                in_flight.popleft()
+                submit_next()
+                row["stat"] = st
+
+                if incomplete:
+                    batch = incomplete_batches.setdefault(handler, [])
+                    batch.append((row, st, file_type, tags))
+                    if urgent or len(batch) >= handler.batch_size:
+                        submit_batch(handler)
+                else:
+                    if not from_cache:
+                        store_in_cache(st, file_type, handler, tags)
+                    apply_tags(row, handler, tags)
+                    n_done += 1
+
+                while batches_in_flight and batches_in_flight[0][2].done():
+                    n_done += await finish_batch()
+                if len(cache_writes) >= CACHE_WRITE_BATCH_SIZE:
+                    await flush_cache_writes()
+                yield n_done / n_rows
+
+            if not stopped():
+                for handler in list(incomplete_batches):
+                    submit_batch(handler)
+            while batches_in_flight and not stopped():
+                n_done += await finish_batch()
+                yield n_done / n_rows
+            await flush_cache_writes()
+        finally:
+            # Rows that weren't finished keep their previous values
+            for row in self.load_queue.pending.values():
+                row["state"] = None
+            for row, *_ in itertools.chain(in_flight, *incomplete_batches.values()):
+                row["state"] = None
+            for handler, batch, future in batches_in_flight:
+                for row, *_ in batch:
+                    row["state"] = None
+            for *_, future in itertools.chain(in_flight, batches_in_flight):
+                future.cancel()
+            self.load_queue = None
+
         yield 1
 
-    async def write_back(self, app, selected_rows=None):
+    async def write_back(self, app, selected_rows=None, stop=None):
+        """Write the shifted timestamps of the given rows, yielding the fraction done as it goes.
+
+        Stops between files once the stop event is set. Each row is marked as queued and
+        then writing, and as saved once it has been written.
+        """
         loop = asyncio.get_running_loop()
         timezone_offset_hours = round(app.current_timezone_offset.total_seconds()/(60**2))
         timezone = datetime.timezone(datetime.timedelta(hours=timezone_offset_hours))
 
         if selected_rows is None:
             selected_rows = self
+        rows = [row for row in selected_rows if row["timestamp"] is not None]
+        for row in rows:
+            row["state"] = ROW_STATE_QUEUED
+
+        try:
+            for i, row in enumerate(rows):
+                yield i / len(rows)
+                if stop is not None and stop.is_set():
+                    break
+                row["state"] = ROW_STATE_WRITING
+                await self.write_row(row, timezone, timezone_offset_hours)
+                row["state"] = ROW_STATE_SAVED
+        finally:
+            for row in rows:
+                if row.is_busy:
+                    row["state"] = None
 
-        for i, row in enumerate(selected_rows):
-            yield i / len(selected_rows)
-            file = row["full_path"]
-            ts_delta = row["delta"]
-            ts_original = row["timestamp"].astimezone(timezone)
-            ts_new = ts_original + ts_delta
-            metadata = await loop.run_in_executor(None, self.get_exiv_metadata, file)
-
-            if metadata is not None:
-                for tag_name, ts in row.iter_exiv_timestamps():
-                    if ts is not None:
-                        ts = round_datetime_to_second(ts.astimezone(timezone) + ts_delta)
-                        row[tag_name] = ts
-                        if isinstance(tag_name, tuple):
-                            date_tag_name, time_tag_name = tag_name
-                            metadata[date_tag_name].value = [ts]
-                            metadata[time_tag_name].value = [ts]
-                        else:
-                            metadata[tag_name].value = ts
-
-                if row["Exif.Image.TimeZoneOffset"] is not None:
-                    row["Exif.Image.TimeZoneOffset"] = timezone_offset_hours
-                    metadata["Exif.Image.TimeZoneOffset"] = timezone_offset_hours
-
-                await loop.run_in_executor(None, metadata.write)
-
-            quicktime_tags = [t for t in QUICKTIME_TIMESTAMP_TAGS if row[t] is not None]
-            if quicktime_tags:
-                def format_arg(tag_name):
-                    ts = row[tag_name].astimezone(datetime.timezone(datetime.timedelta())) + ts_delta
-                    return "-{}={}".format(tag_name, ts.strftime("%Y:%m:%d %H:%M:%S"))
-                def run():
-                    subprocess.run(['exiftool', '-overwrite_original', file] + [
-                        format_arg(t) for t in QUICKTIME_TIMESTAMP_TAGS
-                    ], capture_output=True, check=True)
-                await loop.run_in_executor(None, run)
-
-            avchd_ts = row["AVCHD:Timestamp"]
-            if avchd_ts is not None:
-                for avchd_db in self.avchd_dirs:
-                    if file.startswith(avchd_db.path):
-                        avchd_ts = round_datetime_to_second(avchd_ts.astimezone(timezone) + ts_delta)
-                        avchd_db.get_mts(os.path.basename(file))["datetime"] = avchd_ts
-                        break
-
-            await loop.run_in_executor(None, os.utime, file, (ts_new.timestamp(), ts_new.timestamp()))
-
-        for avchd_db in self.avchd_dirs:
-            await loop.run_in_executor(None, avchd_db.write)
+            for handler in format_handlers.HANDLERS.values():
+                await loop.run_in_executor(None, handler.finish_writes, self)
 
         yield 1
 
+    async def write_row(self, row, timezone, timezone_offset_hours):
+        loop = asyncio.get_running_loop()
+        file = row["full_path"]
+        ts_delta = row["delta"]
+        ts_original = row["timestamp"].astimezone(timezone)
+        ts_new = ts_original + ts_delta
+
+        handler = row["handler"] or format_handlers.OtherHandler
+        values = handler.new_values({t: row[t] for t in handler.tags}, ts_delta, timezone, timezone_offset_hours)
+        if values:
+            written, = await loop.run_in_executor(None, handler.write_many, self, [(file, values)])
+            for tag_name, value in written.items():
+                row[tag_name] = value
+
+        await loop.run_in_executor(None, os.utime, file, (ts_new.timestamp(), ts_new.timestamp()))
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        if self.process_pool is not None:
+            self.process_pool.close()
+        self.exiftool.close()
+        self.metadata_cache.close()
+
     def __iter__(self):
-        it = self.store.get_iter_first()
-        while it is not None:
-            yield self.Row(it)
-            it = self.store.iter_next(it)
+        """The rows, in the order they're shown in."""
+        for i in self.store.order.tolist():
+            yield self.Row(i)
 
     def __len__(self):
-        return len(self.store)
+        return len(self.columns)
 
     def __getitem__(self, pos):
         if isinstance(pos, Gtk.TreePath):
             pos = self.store.get_iter(pos)
-        return self.Row(pos)
+        return self.Row(self.store.get_value(pos, self.idx("id")))
 
     @staticmethod
-    def _iter_given_files(all_given_files):
+    def _scan_dir(root):
+        """List one directory, keeping the FileStat of the stat results that scandir gets.
+
+        Returns the (path, FileStat) of each file, the subdirectories to scan next, and the
+        MplDirectory if root is an AVCHD/BDMV directory. As with os.walk, unreadable
+        directories are skipped and symlinks to directories are not followed.
+        """
+        avchd_db = mpl_extract.MplDirectory(root) if root.endswith("AVCHD/BDMV") else None
+        files = []
+        subdirs = []
+        try:
+            with os.scandir(root) as entries:
+                for entry in entries:
+                    try:
+                        is_dir = entry.is_dir()
+                    except OSError:
+                        is_dir = False
+                    if is_dir:
+                        if not entry.is_symlink():
+                            subdirs.append(entry.path)
+                        continue
+                    try:
+                        st = metadata_cache.file_stat(entry.stat())
+                    except OSError:
+                        # e.g. a broken symlink; reload will stat it again and report the error
+                        st = None
+                    files.append((entry.path, st))
+        except OSError:
+            pass
+        return files, subdirs, avchd_db
+
+    @staticmethod
+    def _stat_given_files(all_given_files):
+        files = []
+        dirs = []
         for f in all_given_files:
-            if os.path.isdir(f):
-                for root, dirs, files in os.walk(f):
-                    if root.endswith("AVCHD/BDMV"):
-                        yield mpl_extract.MplDirectory(os.path.abspath(root))
-                    for f in files:
-                        yield os.path.abspath(os.path.join(root, f))
-            elif os.path.isfile(f):
-                yield os.path.abspath(f)
-            else:
+            f = os.path.abspath(f)
+            try:
+                st = os.stat(f)
+            except FileNotFoundError:
                 raise Exception("File {} does not exist".format(f))
+            if stat.S_ISDIR(st.st_mode):
+                dirs.append(f)
+            else:
+                files.append((f, metadata_cache.file_stat(st)))
+        return files, dirs
 
-    async def populate(self, all_given_files):
-        loop = asyncio.get_running_loop()
-        yield 0.1
-
-        file_list = await loop.run_in_executor(None, lambda: list(self._iter_given_files(all_given_files)))
-
-        for f in file_list:
-            if isinstance(f, mpl_extract.MplDirectory):
-                self.avchd_dirs.append(f)
-        file_list = [f for f in file_list if not isinstance(f, mpl_extract.MplDirectory)]
-        n_files = len(file_list)
-        file_list.sort()
-        yield 0.4
-
-        def get_prefix_length():
-            if n_files == 0:
-                return 0
-            elif n_files == 1:
-                path = file_list[0]
-                return len(path) - len(os.path.basename(path))
+    @staticmethod
+    def _get_prefix_length(files, dirs):
+        """The length of the common prefix of the given files and directories, which is left out of the shortened paths."""
+        roots = files + dirs
+        if len(roots) == 0:
+            return 0
+        elif len(roots) == 1 and len(files) == 1:
+            path = files[0]
+            return len(path) - len(os.path.basename(path))
+        else:
+            length = len(os.path.commonpath(roots))
+            if length == 1:
+                length = 0
             else:
-                length = len(os.path.commonpath(file_list))
-                if length == 1:
-                    length = 0
-                else:
-                    length += 1
-                return length
-        prefix_len = get_prefix_length()
-        yield 0.7
+                length += 1
+            return length
 
-        for f in file_list:
-            self.store.append([f, f[prefix_len:]] + [None]*(len(self._Row.INDICES) - 2))
+    async def populate(self, all_given_files, walk_threads=WALK_THREADS):
+        """Add a row for every given file, and every file under the given directories.
+
+        Directories are listed by up to walk_threads threads at once, which matters on
+        network filesystems where each listing mostly waits on the server. Rows are added
+        in batches as they're found, each at its place in path order, yielding the
+        fraction of the directories found so far that have been listed.
+        """
+        loop = asyncio.get_running_loop()
+        yield 0
+
+        given_files, given_dirs = await loop.run_in_executor(None, self._stat_given_files, all_given_files)
+        prefix_len = self._get_prefix_length([f for f, st in given_files], given_dirs)
+        sorted_paths = sortedcontainers.SortedList()
+
+        def add_files(files):
+            new_rows = []
+            for f, st in files:
+                if f in sorted_paths:
+                    continue
+                sorted_paths.add(f)
+                new_rows.append((f, self.columns.append({"full_path": f, "shortened_path": f[prefix_len:], "stat": st})))
+            new_rows.sort()
+            self.store.insert_many([(sorted_paths.index(f), i) for f, i in new_rows])
+
+        add_files(given_files)
+
+        walker = concurrent.futures.ThreadPoolExecutor(max_workers=walk_threads)
+        pending = {loop.run_in_executor(walker, self._scan_dir, d) for d in given_dirs}
+        batch = []
+        n_scanned = 0
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for future in done:
+                    files, subdirs, avchd_db = future.result()
+                    n_scanned += 1
+                    if avchd_db is not None:
+                        self.avchd_dirs.append(avchd_db)
+                    batch += files
+                    pending |= {loop.run_in_executor(walker, self._scan_dir, d) for d in subdirs}
+                if len(batch) >= POPULATE_BATCH_SIZE or not pending:
+                    add_files(batch)
+                    batch.clear()
+                    yield n_scanned / (n_scanned + len(pending))
+        finally:
+            walker.shutdown(wait=False, cancel_futures=True)
         yield 1
 
 
@@ -510,6 +785,7 @@ class Widgets:
         self.toolbar = builder.get_object("tool_bar")
         self.reload_button = builder.get_object("reload_button")
         self.save_button = builder.get_object("save_button")
+        self.cancel_button = builder.get_object("cancel_button")
         self.status_label = builder.get_object("status_label")
         self.progress_bar = builder.get_object("progress_bar")
         self.treeview = builder.get_object("main_file_list")
@@ -523,6 +799,7 @@ class Widgets:
 
         builder.connect_signals(app)
         self.treeview_selection.connect('changed', app.on_change_selected_image)
+        self.treeview.get_vadjustment().connect('value-changed', app.on_scroll_file_list)
 
         self.treeview_selection.set_mode(Gtk.SelectionMode.MULTIPLE)
 
@@ -548,22 +825,25 @@ class Widgets:
 class Application:
     image_preview: Gtk.Image
 
-    def __init__(self, given_files):
+    def __init__(self, given_files, max_files_in_flight=None, use_process_pool=False):
         self.given_files = given_files
 
         self.widgets = Widgets(self)
 
         self.ui_is_active = False
+        self.current_row_full_path = None
         self.current_original_timestamp = None
         self.current_timestamp_delta = datetime.timedelta()
         self.current_timezone_offset = DEFAULT_TIMEZONE_OFFSET
         self.current_image_is_locked = False
-        self.locked_timestamp_deltas = sortedcontainers.SortedDict()
+        self.anchors = delta_anchors.Anchors()
 
         self.changing_selected_image_task = make_null_task()
         self.updating_delta_db_task = make_null_task()
+        self.job_task = make_null_task()
+        self.job_stop = asyncio.Event()
 
-        self.loaded_files = FileStore()
+        self.loaded_files = FileStore(max_files_in_flight, use_process_pool)
         self.widgets.treeview.set_model(self.loaded_files.store)
         self.setup_treeview()
 
@@ -577,20 +857,75 @@ class Application:
         return self.current_original_timestamp + self.current_timestamp_delta
 
     @classmethod
-    async def start(cls, given_files):
-        self = cls(given_files)
+    async def start(cls, given_files, **kwargs):
+        self = cls(given_files, **kwargs)
         self.widgets.status_label.set_text("Listing files...")
         self.widgets.progress_bar.set_fraction(0)
         async for frac in self.loaded_files.populate(self.given_files):
             self.widgets.progress_bar.set_fraction(frac)
             await gbulb.wait_signal(self.widgets.progress_bar, "draw")
-        self.widgets.status_label.set_text("Reading files...")
-        self.widgets.progress_bar.set_fraction(0)
-        async for frac in self.loaded_files.reload(self):
-            self.widgets.progress_bar.set_fraction(frac)
-        self.widgets.status_label.set_text("")
         self.ui_is_active = True
+        await self.start_job("Reading files...", self.load_files_in_background)
+
+    @property
+    def job_is_running(self):
+        return not self.job_task.done()
+
+    def start_job(self, status, coro_func):
+        """Run a cancellable background operation, e.g. a reload or save.
+
+        Only the rows it is working on are locked, so the rest of the UI stays usable.
+        """
+        self.job_stop = asyncio.Event()
+
+        async def job():
+            self.widgets.status_label.set_text(status)
+            self.widgets.progress_bar.set_fraction(0)
+            try:
+                await coro_func()
+            finally:
+                self.widgets.status_label.set_text("")
+
+        self.job_task = asyncio.create_task(job())
+        self.job_task.add_done_callback(lambda task: self.update_ui())
         self.update_ui()
+        return self.job_task
+
+    async def load_files_in_background(self):
+        """Read all the files, starting with the ones the user can see."""
+        async for frac in self.loaded_files.reload(self, stop=self.job_stop, restat=False):
+            if frac == 0:
+                self.prioritise_visible_rows()
+            self.widgets.progress_bar.set_fraction(frac)
+        self.update_ui()
+
+    def prioritise_visible_rows(self):
+        if self.loaded_files.load_queue is None:
+            return
+        selection = self.get_current_row_selection()
+        # With e.g. every row selected, the selection isn't worth going through on every scroll
+        rows = list(selection) if len(selection) <= MAX_PRIORITISED_SELECTED_ROWS else []
+        visible_range = self.widgets.treeview.get_visible_range()
+        if visible_range is not None:
+            start, end = (path.get_indices()[0] for path in visible_range)
+            rows += [self.loaded_files[Gtk.TreePath(i)] for i in range(start, end + 1)]
+        self.loaded_files.prioritise(rows)
+
+    def on_scroll_file_list(self, adjustment):
+        self.prioritise_visible_rows()
+
+    def on_row_loaded(self, row):
+        if row["state"] == ROW_STATE_SAVED:
+            # The delta has just been applied to the file
+            delta = datetime.timedelta()
+        else:
+            delta = self.anchors.get_delta(row["timestamp"], self.current_timestamp_delta)
+        row.update({
+            "delta": delta,
+            "row-bg-colour": ANCHOR_ROW_COLOUR if row["timestamp"] in self.anchors else ROW_COLOUR,
+        })
+        if row["full_path"] == self.current_row_full_path:
+            self.on_change_selected_image()
 
     def notify(self, title, message):
         dialog = Gtk.MessageDialog(
@@ -607,6 +942,10 @@ class Application:
     def setup_treeview(self):
         loaded_files = self.loaded_files
 
+        col = Gtk.TreeViewColumn('State', Gtk.CellRendererText(), text=loaded_files.idx("state"))
+        col.set_sort_column_id(loaded_files.idx("state"))
+        self.widgets.treeview.append_column(col)
+
         col = Gtk.TreeViewColumn('File', Gtk.CellRendererText(), text=loaded_files.idx("shortened_path"))
         col.set_sort_column_id(loaded_files.idx("shortened_path"))
         self.widgets.treeview.append_column(col)
@@ -656,14 +995,19 @@ class Application:
             self.widgets.timezone_offset_entry.set_text(str(self.current_timezone_offset.total_seconds() / 60**2))
 
         any_selected = self.widgets.treeview.get_selection().count_selected_rows() > 0
-        self.widgets.reload_button.set_sensitive(any_selected)
-        self.widgets.save_button.set_sensitive(any_selected)
+        self.widgets.reload_button.set_sensitive(any_selected and not self.job_is_running)
+        self.widgets.save_button.set_sensitive(any_selected and not self.job_is_running)
+        self.widgets.cancel_button.set_sensitive(self.job_is_running and not self.job_stop.is_set())
+
+        current_row = self.get_current_row()
+        current_row_is_busy = current_row is not None and current_row.is_busy
 
         self.widgets.toolbar.set_sensitive(self.ui_is_active)
         self.widgets.treeview.set_sensitive(self.ui_is_active)
-        self.widgets.tag_edit_form.set_sensitive(self.ui_is_active)
+        self.widgets.tag_edit_form.set_sensitive(self.ui_is_active and not current_row_is_busy)
 
     def on_destroy(self, *args):
+        self.loaded_files.close()
         asyncio.get_event_loop().stop()
 
     @contextlib.asynccontextmanager
@@ -722,13 +1066,15 @@ class Application:
                 self.widgets.image_preview.set_opacity(1)
 
 
+        self.prioritise_visible_rows()
         row = self.get_current_row()
         row_timestamp = row and row["timestamp"]
+        self.current_row_full_path = row and row["full_path"]
 
         if row_timestamp is not None:
             self.current_original_timestamp = row_timestamp.astimezone(datetime.timezone(self.current_timezone_offset))
             self.current_timestamp_delta = row["delta"]
-            self.current_image_is_locked = self.current_original_timestamp in self.locked_timestamp_deltas
+            self.current_image_is_locked = self.current_original_timestamp in self.anchors
             self.changing_selected_image_task = asyncio.create_task(update_thumbnail(row["full_path"]))
         else:
             self.current_original_timestamp = None
@@ -760,63 +1106,74 @@ class Application:
             self.updating_delta_db_task,
         )))
 
+    async def update_dirty_deltas(self):
+        """Set the deltas of the rows in the anchors' dirty interval."""
+        # Only the rows around the changed anchor are affected, but the range left over
+        # from an update that was cancelled part way through is redone too. Rows not
+        # loaded yet, locked by a job, or just saved are skipped; on_row_loaded sets the
+        # delta of rows that are (re)loaded
+        files = self.loaded_files
+        rows, deltas, is_anchor = self.anchors.dirty_rows(
+            files.timestamp_index, self.current_timestamp_delta, lambda row: row["state"] is None,
+        )
+        ids = np.array([row.id for row in rows], dtype=np.intp)
+        for start in range(0, len(rows), DELTA_UPDATE_BATCH_SIZE):
+            await asyncio.sleep(0)
+            batch = [i for i in range(start, min(start + DELTA_UPDATE_BATCH_SIZE, len(rows))) if rows[i]["state"] is None]
+            files.set_deltas(ids[batch], deltas[batch], is_anchor[batch])
+        self.anchors.dirty_interval = None
+
     def update_timestamp_delta_state(self):
         self.updating_delta_db_task.cancel()
 
-        def get_delta(row):
-            if len(self.locked_timestamp_deltas) == 0:
-                return self.current_timestamp_delta
-            elif len(self.locked_timestamp_deltas) == 1:
-                return self.locked_timestamp_deltas.values()[0]
-            else:
-                timestamp = row["timestamp"]
-                upper_i = self.locked_timestamp_deltas.bisect_left(timestamp)
-                lower_i = upper_i - 1
-                if upper_i == len(self.locked_timestamp_deltas):
-                    return self.locked_timestamp_deltas.values()[-1]
-                if lower_i == -1:
-                    return self.locked_timestamp_deltas.values()[0]
-                upper = self.locked_timestamp_deltas.items()[upper_i]
-                lower = self.locked_timestamp_deltas.items()[lower_i]
-                ratio = (timestamp - lower[0]) / (upper[0] - lower[0])
-                return lower[1] + ratio * (upper[1] - lower[1])
-
-        async def coro():
-            for i, row in enumerate(self.loaded_files):
-                if i%40 == 0:
-                    await asyncio.sleep(0.01)
-                row["delta"] = get_delta(row)
-                if row["timestamp"] in self.locked_timestamp_deltas:
-                    row["row-bg-colour"] = "#ffff00"
-                else:
-                    row["row-bg-colour"] = "#ffffff"
+        current_row = self.get_current_row()
+        if current_row is not None and current_row["state"] == ROW_STATE_SAVED:
+            # The user is editing it again, so it follows the anchors from now on
+            current_row["state"] = None
 
         key = self.current_original_timestamp
-        if key is not None:
-            if self.current_image_is_locked:
-                self.locked_timestamp_deltas[key] = self.current_timestamp_delta
-            else:
-                self.locked_timestamp_deltas.pop(key, None)
-                self.current_timestamp_delta = get_delta(self.get_current_row())
+        if key is None:
+            self.anchors.mark_dirty()
+        elif self.current_image_is_locked:
+            self.anchors.set(key, self.current_timestamp_delta)
+        else:
+            self.anchors.remove(key)
+            self.current_timestamp_delta = self.anchors.get_delta(self.get_current_row()["timestamp"], self.current_timestamp_delta)
 
-        self.updating_delta_db_task = asyncio.create_task(coro())
+        self.updating_delta_db_task = asyncio.create_task(self.update_dirty_deltas())
         return self.updating_delta_db_task
 
     def change_current_timestamp_delta(self, delta):
         if self.current_timestamp_delta != delta:
             self.current_timestamp_delta = delta
-            if len(self.locked_timestamp_deltas):
+            if len(self.anchors):
                 self.current_image_is_locked = True
             self.update_timestamp_delta_state()
 
     async def reset_all_deltas(self):
-        self.current_timestamp_delta = datetime.timedelta()
-        self.locked_timestamp_deltas.clear()
-        self.current_image_is_locked = False
-        task = self.update_timestamp_delta_state()
+        for row in self.loaded_files:
+            if row["state"] == ROW_STATE_SAVED:
+                row["state"] = None
+        task = self.clear_anchors()
         self.update_ui()
         await task
 
+    def clear_anchors(self):
+        """Forget the anchors and the current delta."""
+        self.updating_delta_db_task.cancel()
+        self.current_timestamp_delta = datetime.timedelta()
+        self.anchors.clear()
+        self.current_image_is_locked = False
+        self.updating_delta_db_task = asyncio.create_task(self.update_dirty_deltas())
+        return self.updating_delta_db_task
+
+    def forget_anchors(self, keys):
+        """Forget the anchors at keys, e.g. once their rows' deltas have been written to the files."""
+        self.updating_delta_db_task.cancel()
+        self.anchors.forget(keys)
+        self.updating_delta_db_task = asyncio.create_task(self.update_dirty_deltas())
+        return self.updating_delta_db_task
+
     def on_timestamp_entry_changed(self, entry):
         new_ts = self.widgets.parse_timestamp_entry()
         if new_ts is None:
@@ -861,44 +1218,64 @@ class Application:
             self.widgets.treeview.set_sensitive(True)
 
     def on_click_reload(self, *args):
+        rows = list(self.get_current_row_selection())
+
         async def coro():
             await self.any_ongoing_db_changes()
-
-            self.ui_is_active = False
-            self.update_ui()
-            self.widgets.status_label.set_text("Reloading...")
-            self.widgets.progress_bar.set_fraction(0)
-
             await self.reset_all_deltas()
-            async for frac in self.loaded_files.reload(self, self.get_current_row_selection()):
+            async for frac in self.loaded_files.reload(self, rows, stop=self.job_stop):
+                if frac == 0:
+                    # The rows are now marked as busy
+                    self.update_ui()
                 self.widgets.progress_bar.set_fraction(frac)
-            self.widgets.status_label.set_text("")
-            self.ui_is_active = True
-
+            self.update_ui()
             self.on_change_selected_image()
 
-        return asyncio.create_task(coro())
+        return self.start_job("Reloading...", coro)
 
     def on_click_save(self, *args):
+        rows = list(self.get_current_row_selection())
+
         async def coro():
             await self.any_ongoing_db_changes()
-
-            self.ui_is_active = False
+            # The anchors are keyed on the timestamps from before the save
+            timestamps_before = {row.id: row["timestamp"] for row in rows}
+            async for frac in self.loaded_files.write_back(self, rows, stop=self.job_stop):
+                if frac == 0:
+                    # The rows are now marked as busy
+                    self.update_ui()
+                self.widgets.progress_bar.set_fraction(frac)
             self.update_ui()
-            self.widgets.status_label.set_text("Writing...")
-            self.widgets.progress_bar.set_fraction(0)
-            async for frac in self.loaded_files.write_back(self, self.get_current_row_selection()):
+
+            # Read back whatever was written, even if cancelled part way through
+            self.widgets.status_label.set_text("Reloading...")
+            saved_rows = [row for row in rows if row["state"] == ROW_STATE_SAVED]
+            async for frac in self.loaded_files.reload(self, saved_rows, loaded_state=ROW_STATE_SAVED):
                 self.widgets.progress_bar.set_fraction(frac)
+            # The saved rows' anchors would shift them again if they were edited. Other
+            # anchors, and the deltas of the rows that weren't saved, are kept
+            await self.forget_anchors([timestamps_before[row.id] for row in saved_rows])
+            self.on_change_selected_image()
 
-            await self.on_click_reload()
+        return self.start_job("Writing...", coro)
 
-        return asyncio.create_task(coro())
+    def on_click_cancel(self, *args):
+        if self.job_is_running:
+            self.job_stop.set()
+            self.widgets.status_label.set_text("Cancelling...")
+            self.update_ui()
 
 
 def main():
     given_files = sys.argv[1:]
+    max_files_in_flight = int(os.environ.get("PHOTOTIMESHIFT_JOBS", 0)) or None
+    use_process_pool = bool(os.environ.get("PHOTOTIMESHIFT_PROCESS_POOL"))
     loop = asyncio.get_event_loop()
-    loop.create_task(Application.start(given_files))
+    loop.create_task(Application.start(
+        given_files,
+        max_files_in_flight=max_files_in_flight,
+        use_process_pool=use_process_pool,
+    ))
     loop.run_forever()
 
 
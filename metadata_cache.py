@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+
+import os
+import pickle
+import sqlite3
+import threading
+import collections
+
+# The parts of a file's stat result that are kept for each row: the cache key, and the mtime
+FileStat = collections.namedtuple("FileStat", "dev ino size ctime_ns mtime_ns")
+
+
+def file_stat(stat_result):
+    return FileStat(
+        stat_result.st_dev, stat_result.st_ino, stat_result.st_size, stat_result.st_ctime_ns, stat_result.st_mtime_ns,
+    )
+
+
+def default_cache_path():
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return os.path.join(cache_home, "phototimeshift", "metadata.sqlite")
+
+
+class MetadataCache:
+    """Persistent cache of the decoded tag values of each file.
+
+    Entries are keyed by (device, inode, size, ctime_ns) rather than by path or mtime:
+    write_back deliberately rewrites mtime with os.utime, but any change to a file's
+    contents or metadata bumps its ctime.
+    """
+
+    # Bump this whenever the meaning of the cached values changes
+    VERSION = 3
+
+    def __init__(self, path=None):
+        if path is None:
+            path = default_cache_path()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        with self.lock, self.db:
+            if self.db.execute("PRAGMA user_version").fetchone()[0] != self.VERSION:
+                self.db.execute("DROP TABLE IF EXISTS files")
+                self.db.execute(f"PRAGMA user_version = {self.VERSION}")
+            self.db.execute("""
+                CREATE TABLE IF NOT EXISTS files (
+                    dev INTEGER NOT NULL,
+                    ino INTEGER NOT NULL,
+                    size INTEGER NOT NULL,
+                    ctime_ns INTEGER NOT NULL,
+                    tags BLOB NOT NULL,
+                    PRIMARY KEY (dev, ino)
+                )
+            """)
+
+    @staticmethod
+    def key_of(st):
+        """The key of the file with the given FileStat."""
+        return st.dev, st.ino, st.size, st.ctime_ns
+
+    def get(self, key):
+        dev, ino, size, ctime_ns = key
+        with self.lock:
+            found = self.db.execute(
+                "SELECT tags FROM files WHERE dev = ? AND ino = ? AND size = ? AND ctime_ns = ?",
+                (dev, ino, size, ctime_ns),
+            ).fetchone()
+        if found is None:
+            return None
+        return pickle.loads(found[0])
+
+    def put_many(self, items):
+        rows = [(*key, pickle.dumps(tags)) for key, tags in items]
+        with self.lock, self.db:
+            self.db.executemany("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)", rows)
+
+    def close(self):
+        with self.lock:
+            self.db.close()
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+
+import re
+import datetime
+import pyexiv2
+import file_types
+import jpeg_metadata
+
+# Extracts the tag values of a single file. This deliberately doesn't depend on GTK, so
+# that it can also run in the worker processes of FileStore's optional process pool,
+# which import it (and so pyexiv2) through format_handlers.
+
+EXIF_TIMESTAMP_TAGS = (
+    "Exif.Image.DateTime",
+    "Exif.Photo.DateTimeOriginal",
+    "Exif.Photo.DateTimeDigitized",
+    "Exif.Image.DateTimeOriginal",
+    "Exif.Image.PreviewDateTime",
+)
+EXIF_TAGS = (
+    "Exif.Image.Model",
+    "Exif.Image.TimeZoneOffset",
+) + EXIF_TIMESTAMP_TAGS
+
+XMP_TIMESTAMP_TAGS = (
+    "Xmp.xmp.CreateDate",
+    "Xmp.photoshop.DateCreated",
+)
+XMP_TAGS = XMP_TIMESTAMP_TAGS
+
+IPTC_TIMESTAMP_TAGS = (
+    ("Iptc.Application2.DateCreated", "Iptc.Application2.TimeCreated"),
+    ("Iptc.Application2.DigitizationDate", "Iptc.Application2.DigitizationTime"),
+)
+IPTC_TAGS = IPTC_TIMESTAMP_TAGS
+
+QUICKTIME_TIMESTAMP_TAGS = (
+    "Quicktime:CreateDate",
+    "Quicktime:ModifyDate",
+    "Quicktime:TrackCreateDate",
+    "Quicktime:TrackModifyDate",
+    "Quicktime:MediaCreateDate",
+    "Quicktime:MediaModifyDate",
+)
+QUICKTIME_TAGS = QUICKTIME_TIMESTAMP_TAGS
+
+NIKON_TAGS = (
+    "Nikon:TimeZone",
+    "Nikon:DaylightSavings",
+)
+
+AVCHD_TAGS = (
+    "AVCHD:Timestamp",
+    # From the clip's CLIPINF file, so only known for clips in an AVCHD directory
+    "AVCHD:Duration",
+)
+
+ALL_TAGS = EXIF_TAGS + XMP_TAGS + IPTC_TAGS + QUICKTIME_TAGS + NIKON_TAGS + AVCHD_TAGS
+
+
+def get_exiv_metadata(f):
+    metadata = pyexiv2.ImageMetadata(f)
+    try:
+        metadata.read()
+    except:
+        return None
+    else:
+        return metadata
+
+
+def get_exiv_tags(f, file_type=file_types.JPEG):
+    SENTINEL = object()
+
+    # Most files are plain JPEGs, which can be read far faster without pyexiv2
+    if file_type == file_types.JPEG:
+        result = jpeg_metadata.read_tags(f)
+        if result is not None:
+            return result
+    result = {}
+
+    metadata = get_exiv_metadata(f)
+    if metadata is None:
+        return result
+
+    for tag_name in XMP_TAGS:
+        tag = metadata.get(tag_name, SENTINEL)
+        if tag is not SENTINEL:
+            try:
+                result[tag_name] = tag.value
+            except pyexiv2.xmp.XmpValueError:
+                match = re.fullmatch(r'(\d+)-(\d+)-(\d+)T(\d+):(\d+):(\d+\.?\d*)((?:[+-]\d+:\d+)?)', tag.raw_value)
+                if match:
+                    year, month, day, hours, minutes, seconds, offset = match.groups()
+                    if not offset:
+                        offset = "+00:00"
+                    tag.raw_value = f"{year}-{month}-{day}T{hours}:{minutes}:{float(seconds):09.6f}{offset}"
+                    result[tag_name] = tag.value
+                else:
+                    raise
+
+    for tag_name in EXIF_TAGS:
+        tag = metadata.get(tag_name, SENTINEL)
+        if tag is not SENTINEL:
+            result[tag_name] = tag.value
+    assert SENTINEL is metadata.get("Exif.Photo.SubSecTime", SENTINEL)
+    assert SENTINEL is metadata.get("Exif.Photo.SubSecTimeOriginal", SENTINEL)
+    assert SENTINEL is metadata.get("Exif.Photo.SubSecTimeDigitized", SENTINEL)
+
+    for tag_name in IPTC_TAGS:
+        if isinstance(tag_name, tuple):
+             date_tag_name, time_tag_name = tag_name
+             date_tag = metadata.get(date_tag_name, SENTINEL)
+             time_tag = metadata.get(time_tag_name, SENTINEL)
+             if date_tag is not SENTINEL and time_tag is not SENTINEL:
+                assert len(date_tag.value) == 1
+                assert len(time_tag.value) == 1
+                result[tag_name] = datetime.datetime.combine(date_tag.value[0], time_tag.value[0])
+        else:
+            tag = metadata.get(tag_name, SENTINEL)
+            if tag is not SENTINEL:
+                result[tag_name] = tag.value
+
+    return result
+
+
+def compact_value(value):
+    """Replace pyexiv2's tzinfo objects with datetime.timezone, which pickles compactly."""
+    if isinstance(value, (datetime.datetime, datetime.time)) and value.tzinfo is not None:
+        if not isinstance(value.tzinfo, datetime.timezone):
+            if isinstance(value, datetime.datetime):
+                offset = value.utcoffset()
+            else:
+                offset = value.tzinfo.utcoffset(None)
+            return value.replace(tzinfo=datetime.timezone(offset))
+    return value
+
+
+def read_tags(handler, f, file_type):
+    """Read a file's tags with the given FormatHandler.
+
+    Returns a record of the values in ALL_TAGS order (None where absent), and whether the
+    file still has to go through the handler's read_many.
+    """
+    tags, incomplete = handler.read(f, file_type)
+    return tuple(compact_value(tags.get(t)) for t in ALL_TAGS), incomplete
+
+
+def record_to_tags(record):
+    return {t: value for t, value in zip(ALL_TAGS, record) if value is not None}
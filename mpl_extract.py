@@ -4,12 +4,69 @@ import sys
 import os
 import datetime
 import json
+import collections
+import struct
+import shutil
 
 
 class MplFileException(Exception):
     pass
 
 
+def bcd_to_int(value):
+    """Decode a binary-coded decimal, e.g. 0x2019 -> 2019."""
+    result = 0
+    for shift in range(12, -1, -4):
+        digit = (value >> shift) & 0xF
+        if digit > 9:
+            raise MplFileException(f"Bad BCD value {value:#x}")
+        result = result*10 + digit
+    return result
+
+
+def int_to_bcd(value):
+    """Encode a binary-coded decimal, e.g. 2019 -> 0x2019."""
+    result = 0
+    for shift in range(0, 16, 4):
+        value, digit = divmod(value, 10)
+        result |= digit << shift
+    if value:
+        raise MplFileException("Value too big for 4 BCD digits")
+    return result
+
+
+def write_files_atomically(items):
+    """Replace each of the given (path, contents) files, such that none is ever left half-written.
+
+    Each file is written to a temporary file next to it, and all of them are synced before
+    any is renamed into place. Each directory is then synced once, after its last rename.
+    """
+    temp_paths = []
+    try:
+        for path, contents in items:
+            temp_path = os.path.join(os.path.dirname(path), "." + os.path.basename(path) + ".tmp")
+            temp_paths.append(temp_path)
+            with open(temp_path, "wb") as f:
+                f.write(contents)
+                f.flush()
+                os.fsync(f.fileno())
+            if os.path.exists(path):
+                shutil.copymode(path, temp_path)
+        for (path, _), temp_path in zip(items, temp_paths):
+            os.replace(temp_path, path)
+    finally:
+        for temp_path in temp_paths:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    for directory in {os.path.dirname(path) for path, _ in items}:
+        fd = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+
 class MtsInfo:
     def __init__(self, seek_pos, info):
         self.seek_pos = seek_pos
@@ -26,6 +83,13 @@ class MtsInfo:
 
 class MplFile:
     SIGNATURE = b"MPLS0100"
+    NUM_DESC_POS = 65
+    TRAILER_SIZE = 50
+    DESC_SIZE = 66
+    TIMESTAMP_SIG = b'\x01\x03\x05\x01\x00\x00\x00\x02'
+    # Clip number, 0x1E, BCD year, month, day, hour, minute and second, 0x900A/0x900C, "YYYY.MM.DD"
+    TIMESTAMP_STRUCT = struct.Struct(">HBH5B2s10s")
+    DATE_MARKERS = {b'\x90\x0A', b'\x90\x0C'}
 
     def __init__(self, filepath):
         self.filepath = filepath
@@ -44,125 +108,263 @@ class MplFile:
         except FileNotFoundError:
             pass
 
+        # Playlists are a few KB, so read the whole thing at once and decode it in memory
         with open(self.filepath, "rb") as f:
+            data = f.read()
+
+        if not data.startswith(self.SIGNATURE):
+            raise MplFileException("Could not read file signature. Wrong filetype?")
+
+        # find out how many mts files are described
+        # the 66th byte contains this number
+        if len(data) < self.NUM_DESC_POS + 1:
+            raise MplFileException("Could not read contents")
+        num_desc = data[self.NUM_DESC_POS]
+
+        # the descriptors come just before the trailer, and their actual info starts with a
+        # time stamp signature 36 bytes in
+        first_pos = len(data) - self.TRAILER_SIZE - self.DESC_SIZE*num_desc + 2
+        if first_pos < self.NUM_DESC_POS + 1:
+            raise MplFileException("Too many descriptors for the file size")
+
+        for pos in range(first_pos, first_pos + self.DESC_SIZE*num_desc, self.DESC_SIZE):
+            if data[pos:pos + len(self.TIMESTAMP_SIG)] != self.TIMESTAMP_SIG:
+                raise MplFileException(f"No time stamp signature at {pos}")
+            timestamp_seek_pos = pos + len(self.TIMESTAMP_SIG)
+
+            mts_number, marker, year, month, day, hour, minute, second, date_marker, date_text = \
+                self.TIMESTAMP_STRUCT.unpack_from(data, timestamp_seek_pos)
+            if marker != 0x1E or date_marker not in self.DATE_MARKERS:
+                raise MplFileException(f"Unexpected time stamp layout at {timestamp_seek_pos}")
+            mts_filename = "{:05d}.MTS".format(mts_number)
+
+            dt = datetime.datetime(*(bcd_to_int(v) for v in (year, month, day, hour, minute, second)))
+            tzoffset_seconds = self.tz_dict.get(mts_filename)
+            if tzoffset_seconds is not None:
+                dt = dt.replace(tzinfo=datetime.timezone(datetime.timedelta(seconds=tzoffset_seconds)))
+
+            if date_text != f"{dt.year:4d}.{dt.month:2d}.{dt.day:2d}".encode('ascii'):
+                raise MplFileException(f"Time stamp of {mts_filename} doesn't match its date text")
+
+            self.db[mts_filename] = MtsInfo(seek_pos=timestamp_seek_pos, info={
+                "datetime": dt,
+            })
+
+    def prepare_write(self):
+        """Patch the dirty time stamps into a copy of the playlist.
+
+        Returns the (path, contents) of the playlist and its timezone sidecar, or nothing
+        if there's nothing to write. Nothing is marked as clean until mark_written.
+        """
+        if not any(info.dirty for info in self.db.values()):
+            return []
 
-            if f.read(len(self.SIGNATURE)) != self.SIGNATURE:
-                raise MplFileException("Could not read file signature. Wrong filetype?")
-
-            # find out how many mts files are described
-            # the 66th byte contains this number
-            f.seek(66 - len(self.SIGNATURE) - 1, os.SEEK_CUR)
-            ret = f.read(1)
-            if len(ret) != 1:
-                raise MplFileException("Could not read contents")
-            num_desc = ord(ret)
-
-            # jump to the first occurance of a time stamp and print it
-            # iterate till all num_desc time stamps are shown
-            # trailer = 50 bytes
-            # mts description = 66 bytes
-            # actual info starts at 9th byte of mts description
-            f.seek(-50 - 66*num_desc - 36 + 2, os.SEEK_END)
-
-            while num_desc > 0:
-                time_stamp_sig = b'\x01\x03\x05\x01\x00\x00\x00\x02'
+        with open(self.filepath, "rb") as f:
+            data = bytearray(f.read())
+        tz_dict = dict(self.tz_dict)
+
+        for mts_filename, info in self.db.items():
+            if not info.dirty:
+                continue
+            dt = info["datetime"]
+
+            mts_number, marker, *_, date_marker, _ = self.TIMESTAMP_STRUCT.unpack_from(data, info.seek_pos)
+            if mts_number != int(mts_filename[:-4]) or marker != 0x1E or date_marker not in self.DATE_MARKERS:
+                raise MplFileException(f"{self.filepath} has changed since it was read")
+            self.TIMESTAMP_STRUCT.pack_into(
+                data, info.seek_pos,
+                mts_number, marker,
+                *(int_to_bcd(v) for v in (dt.year, dt.month, dt.day, dt.hour, dt.minute, dt.second)),
+                date_marker, f"{dt.year:4d}.{dt.month:2d}.{dt.day:2d}".encode('ascii'),
+            )
+
+            if dt.tzinfo is None:
+                tz_dict.pop(mts_filename, None)
+            else:
+                tz_dict[mts_filename] = dt.tzinfo.utcoffset(None).total_seconds()
+
+        self.pending_tz_dict = tz_dict
+        return [
+            (self.filepath, bytes(data)),
+            (self.timezone_filepath, json.dumps(tz_dict).encode('utf8')),
+        ]
+
+    def mark_written(self):
+        self.tz_dict = self.pending_tz_dict
+        for info in self.db.values():
+            info.dirty = False
 
-                num_desc -= 1
-                f.seek(36, os.SEEK_CUR)
+    def write(self):
+        write_files_atomically(self.prepare_write())
+        self.mark_written()
 
-                # scan for time stamp signature
-                assert f.read(len(time_stamp_sig)) == time_stamp_sig
 
-                timestamp_seek_pos = f.tell()
+class ClpiFileException(Exception):
+    pass
 
-                # scan time stamp
-                mts_filename = "{:05d}.MTS".format(int.from_bytes(f.read(2), byteorder='big'))
-                assert f.read(1) == b'\x1E'
-                year = int("{:x}".format(int.from_bytes(f.read(2), byteorder='big')))
 
-                datetime_values = (
-                    int("{:x}".format(ord(f.read(1)))) for _ in range(5)
-                )
+StcSequence = collections.namedtuple(
+    "StcSequence", ("pcr_pid", "spn_stc_start", "presentation_start_time", "presentation_end_time")
+)
+AtcSequence = collections.namedtuple("AtcSequence", ("spn_atc_start", "offset_stc_id", "stc_sequences"))
 
-                dt = datetime.datetime(year, *datetime_values)
-                tzoffset_seconds = self.tz_dict.get(mts_filename)
-                if tzoffset_seconds is not None:
-                    dt = dt.replace(tzinfo=datetime.timezone(datetime.timedelta(seconds=tzoffset_seconds)))
 
-                assert f.read(2) in {b'\x90\x0A', b'\x90\x0C'}
-                assert f.read(10) == f"{dt.year:4d}.{dt.month:2d}.{dt.day:2d}".encode('ascii')
+class ClpiFile:
+    """The clip information (CLIPINF/*.CPI) of one clip, decoded from a single read.
 
-                self.db[mts_filename] = MtsInfo(seek_pos=timestamp_seek_pos, info={
-                    "datetime": dt,
-                })
+    Presentation times are in ticks of the 45kHz clock, and count from an arbitrary
+    origin, so only differences between them are meaningful.
+    """
 
-    def write(self):
-        if not any(info.dirty for info in self.db.values()):
-            return
+    SIGNATURE = b"HDMV"
+    CLOCK_RATE = 45000
+    # Type indicator, version, and the addresses of SequenceInfo, ProgramInfo, CPI, ClipMark and ExtensionData
+    HEADER_STRUCT = struct.Struct(">4s4s5I")
+    CLIP_INFO_POS = 40
+    # Length, reserved, clip stream type, application type, ATC delta flag, TS recording rate, number of source packets
+    CLIP_INFO_STRUCT = struct.Struct(">IHBBIII")
+    SEQUENCE_INFO_STRUCT = struct.Struct(">IxB")
+    ATC_SEQUENCE_STRUCT = struct.Struct(">IBB")
+    STC_SEQUENCE_STRUCT = struct.Struct(">HIII")
 
-        with open(self.filepath, "r+b") as f:
-            for mts_filename, info in self.db.items():
-                if not info.dirty:
-                    continue
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self.atc_sequences = []
+        self.read()
 
-                f.seek(info.seek_pos)
-                dt = info["datetime"]
+    def read(self):
+        with open(self.filepath, "rb") as f:
+            data = f.read()
 
-                assert f.read(2) == int(mts_filename[:-4]).to_bytes(2, byteorder='big')
-                assert f.read(1) == b'\x1E'
-                f.write(int(f"{dt.year}", 16).to_bytes(2, byteorder='big'))
+        try:
+            type_indicator, version, sequence_info_pos, *_ = self.HEADER_STRUCT.unpack_from(data, 0)
+            if type_indicator != self.SIGNATURE:
+                raise ClpiFileException("Could not read file signature. Wrong filetype?")
+            self.version = version.decode('ascii', 'replace')
+
+            _, _, self.clip_stream_type, self.application_type, _, self.ts_recording_rate, \
+                self.number_of_source_packets = self.CLIP_INFO_STRUCT.unpack_from(data, self.CLIP_INFO_POS)
+
+            _, num_atc_sequences = self.SEQUENCE_INFO_STRUCT.unpack_from(data, sequence_info_pos)
+            pos = sequence_info_pos + self.SEQUENCE_INFO_STRUCT.size
+            self.atc_sequences = []
+            for _ in range(num_atc_sequences):
+                spn_atc_start, num_stc_sequences, offset_stc_id = self.ATC_SEQUENCE_STRUCT.unpack_from(data, pos)
+                pos += self.ATC_SEQUENCE_STRUCT.size
+                stc_sequences = []
+                for _ in range(num_stc_sequences):
+                    stc_sequences.append(StcSequence(*self.STC_SEQUENCE_STRUCT.unpack_from(data, pos)))
+                    pos += self.STC_SEQUENCE_STRUCT.size
+                self.atc_sequences.append(AtcSequence(spn_atc_start, offset_stc_id, stc_sequences))
+        except struct.error:
+            raise ClpiFileException("Truncated file")
+
+    def iter_stc_sequences(self):
+        for atc_sequence in self.atc_sequences:
+            yield from atc_sequence.stc_sequences
+
+    @property
+    def presentation_start_time(self):
+        return next((stc.presentation_start_time for stc in self.iter_stc_sequences()), None)
+
+    @property
+    def duration(self):
+        ticks = sum(
+            (stc.presentation_end_time - stc.presentation_start_time) % 2**32
+            for stc in self.iter_stc_sequences()
+        )
+        return datetime.timedelta(seconds=ticks / self.CLOCK_RATE)
 
-                for val in (dt.month, dt.day, dt.hour, dt.minute, dt.second):
-                    f.write(bytes((int(f"{val}", 16),)))
 
-                assert f.read(2) in {b'\x90\x0A', b'\x90\x0C'}
+class MplDirectory:
+    """The playlists of an AVCHD/BDMV directory, indexed by the clips they describe.
 
-                f.write(f"{dt.year:4d}.{dt.month:2d}.{dt.day:2d}".encode('ascii'))
+    A clip can be in several playlists (including the copies under BACKUP), so each
+    absolute STREAM path maps to every (MplFile, MtsInfo) describing it, with the ones
+    from outside BACKUP first. The clips' CLIPINF files are indexed by STREAM path too.
+    """
 
-                if dt.tzinfo is None:
-                    self.tz_dict.pop(mts_filename, None)
-                else:
-                    self.tz_dict[mts_filename] = dt.tzinfo.utcoffset(None).total_seconds()
+    def __init__(self, path):
+        self.path = path
+        self.clips = {}
+        self.mpl_files = {}
+        self.clip_infos = {}
 
-                info.dirty = False
+    def stream_path(self, mts_name):
+        return os.path.join(self.path, "STREAM", mts_name)
 
-        with open(self.timezone_filepath, "w") as f:
-            json.dump(self.tz_dict, f)
+    def get_clip(self, stream_path):
+        return self.clips[stream_path][0]
 
+    def get_mts(self, stream_path):
+        return self.get_clip(stream_path)[1]
 
+    def get_clip_info(self, stream_path):
+        return self.clip_infos.get(stream_path)
 
-class MplDirectory:
-    def __init__(self, path):
-        self.path = path
-        self.db = {}
-        self.mpl_files = {}
+    def get_clip_end(self, stream_path):
+        """When recording of the clip stopped, or None if its CLIPINF file is missing."""
+        clip_info = self.get_clip_info(stream_path)
+        if clip_info is None:
+            return None
+        return self.get_mts(stream_path)["datetime"] + clip_info.duration
 
-    def get_mts(self, mts_name):
-        return self.db[mts_name]
+    def set_datetime(self, stream_path, dt):
+        for mpl, info in self.clips[stream_path]:
+            info["datetime"] = dt
 
     def print(self):
-        for mts_name, info in self.db.items():
-            print("{}: {} {}".format(mts_name, info['datetime'], info['datetime'].tzinfo))
+        for stream_path, ((mpl, info), *_) in sorted(self.clips.items()):
+            print("{}: {} {} (until {})".format(
+                stream_path, info['datetime'], info['datetime'].tzinfo, self.get_clip_end(stream_path)
+            ))
 
     def read(self):
+        mpl_paths = []
+        cpi_paths = []
         for root, dirs, files in os.walk(self.path):
             for file in files:
                 if file.endswith(".MPL"):
-                    filepath = os.path.join(root, file)
-                    self.mpl_files[filepath] = mpl = MplFile(filepath)
-                    self.db.update(mpl.db)
+                    mpl_paths.append(os.path.join(root, file))
+                elif file.endswith(".CPI"):
+                    cpi_paths.append(os.path.join(root, file))
+
+        def is_backup(p):
+            return "BACKUP" in os.path.relpath(p, self.path).split(os.sep)
+        mpl_paths.sort(key=lambda p: (is_backup(p), p))
+        cpi_paths.sort(key=lambda p: (is_backup(p), p))
+
+        self.mpl_files = {}
+        self.clips = {}
+        for filepath in mpl_paths:
+            self.mpl_files[filepath] = mpl = MplFile(filepath)
+            for mts_name, info in mpl.db.items():
+                self.clips.setdefault(self.stream_path(mts_name), []).append((mpl, info))
+
+        # Clip information is only extra detail, so unreadable files are left out
+        self.clip_infos = {}
+        for filepath in cpi_paths:
+            stream_path = self.stream_path(os.path.basename(filepath)[:-4] + ".MTS")
+            if stream_path not in self.clip_infos:
+                try:
+                    self.clip_infos[stream_path] = ClpiFile(filepath)
+                except (ClpiFileException, OSError):
+                    pass
 
     def write(self):
-        for mpl in self.mpl_files.values():
-            mpl.write()
+        """Write every changed playlist, including the copies under BACKUP, in one batch."""
+        dirty = [mpl for mpl in self.mpl_files.values() if any(info.dirty for info in mpl.db.values())]
+        write_files_atomically([item for mpl in dirty for item in mpl.prepare_write()])
+        for mpl in dirty:
+            mpl.mark_written()
 
 
 def main():
     mpl = MplDirectory(path=sys.argv[1])
     mpl.read()
 
-    dt = mpl.get_mts("00127.MTS")["datetime"]
-    # mpl.get_mts("00127.MTS")["datetime"] = dt.replace(year=2520, month=6, day=2, hour=23, minute=50, second=51, tzinfo=datetime.timezone(datetime.timedelta(hours=3)))
+    dt = mpl.get_mts(mpl.stream_path("00127.MTS"))["datetime"]
+    # mpl.set_datetime(mpl.stream_path("00127.MTS"), dt.replace(year=2520, month=6, day=2, hour=23, minute=50, second=51, tzinfo=datetime.timezone(datetime.timedelta(hours=3))))
 
     mpl.print()
     mpl.write()
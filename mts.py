@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+
+import re
+import sys
+import mmap
+import datetime
+import collections
+
+# Reads the recording time that AVCHD cameras put in the MDPM ("Modified DV Pack Meta")
+# user data SEI of the H.264 stream in .MTS files, by scanning the first transport stream
+# packets in an mmap rather than decoding any video. This is the only timestamp a clip has
+# once it's been copied out of its AVCHD directory.
+
+TS_PACKET_SIZE = 188
+TS_SYNC_BYTE = 0x47
+# .MTS/.M2TS files put a 4 byte timecode before each packet
+TIMECODE_SIZE = 4
+
+# The SEI payload is this UUID, "MDPM", a count, and then that many 5 byte (tag, value) entries
+MDPM_SIGNATURE = bytes.fromhex("17ee8c60f84d11d98cd60800200c9a66") + b"MDPM"
+MDPM_ENTRY_SIZE = 5
+# Time zone, BCD year (2 bytes) and BCD month
+MDPM_DATE_TAG = 0x18
+# BCD day, hour, minute and second
+MDPM_TIME_TAG = 0x19
+
+# The time zone byte, as decoded by exiftool
+TZ_INVALID = 0x80
+TZ_DST = 0x40
+TZ_NEGATIVE = 0x20
+TZ_HOURS_MASK = 0x1e
+TZ_HALF_HOUR = 0x01
+
+# The first SEI comes with the first picture, well within this many packets
+MAX_PACKETS_READ = 500
+
+# Emulation prevention bytes, which are removed from NAL unit payloads before parsing
+EMULATION_PREVENTION_RE = re.compile(b"\0\0\3")
+
+
+class UnsupportedLayout(Exception):
+    pass
+
+
+def find_packet_layout(data):
+    """Return the offset of the first packet and the packet size.
+
+    Packets are either plain or, as in .MTS/.M2TS files, each preceded by a timecode.
+    Raises UnsupportedLayout if data doesn't start with two packets of either kind.
+    """
+    for offset, packet_size in ((TIMECODE_SIZE, TIMECODE_SIZE + TS_PACKET_SIZE), (0, TS_PACKET_SIZE)):
+        if len(data) > offset + packet_size and data[offset] == TS_SYNC_BYTE == data[offset + packet_size]:
+            return offset, packet_size
+    raise UnsupportedLayout("Not a transport stream")
+
+
+def iter_packet_payloads(data, offset, packet_size, max_packets):
+    """Yield (pid, payload_start, payload_end) for each packet."""
+    end = min(len(data) - TS_PACKET_SIZE + 1, offset + packet_size*max_packets)
+    for pos in range(offset, end, packet_size):
+        if data[pos] != TS_SYNC_BYTE:
+            raise UnsupportedLayout(f"Lost sync at {pos}")
+        pid = ((data[pos + 1] & 0x1f) << 8) | data[pos + 2]
+        adaptation_field_control = (data[pos + 3] >> 4) & 3
+        payload_start = pos + 4
+        if adaptation_field_control & 2:
+            payload_start += 1 + data[pos + 4]
+        if adaptation_field_control & 1 and payload_start < pos + TS_PACKET_SIZE:
+            yield pid, payload_start, pos + TS_PACKET_SIZE
+
+
+def bcd_byte_to_int(value):
+    """Decode a single binary-coded decimal byte, e.g. 0x19 -> 19."""
+    if value >> 4 > 9 or value & 0xf > 9:
+        raise ValueError(f"Bad BCD value {value:#x}")
+    return (value >> 4)*10 + (value & 0xf)
+
+
+def parse_mdpm(data):
+    """Parse the entries following MDPM_SIGNATURE into a dict of tag -> 4 byte value."""
+    data = EMULATION_PREVENTION_RE.sub(b"\0\0", data)
+    entries = {}
+    for pos in range(1, 1 + MDPM_ENTRY_SIZE*data[0], MDPM_ENTRY_SIZE):
+        entry = data[pos:pos + MDPM_ENTRY_SIZE]
+        if len(entry) != MDPM_ENTRY_SIZE:
+            break
+        entries.setdefault(entry[0], entry[1:])
+    return entries
+
+
+def decode_datetime(entries):
+    date, time = entries.get(MDPM_DATE_TAG), entries.get(MDPM_TIME_TAG)
+    if date is None or time is None:
+        return None
+    tz, year_high, year_low, month = date
+    try:
+        dt = datetime.datetime(
+            bcd_byte_to_int(year_high)*100 + bcd_byte_to_int(year_low), bcd_byte_to_int(month),
+            *map(bcd_byte_to_int, time),
+        )
+    except ValueError:
+        return None
+    if not tz & TZ_INVALID:
+        offset = datetime.timedelta(hours=(tz & TZ_HOURS_MASK) >> 1, minutes=30 if tz & TZ_HALF_HOUR else 0)
+        dt = dt.replace(tzinfo=datetime.timezone(-offset if tz & TZ_NEGATIVE else offset))
+    return dt
+
+
+def read_timestamp(path):
+    """Read the recording time from the first MDPM in a transport stream.
+
+    Only the first MAX_PACKETS_READ packets are looked at. Returns None if there's no
+    MDPM there, or the file isn't a transport stream.
+    """
+    try:
+        with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            offset, packet_size = find_packet_layout(data)
+            # The payloads of each elementary stream, joined up so that the SEI can span packets
+            streams = collections.defaultdict(bytearray)
+            for pid, start, end in iter_packet_payloads(data, offset, packet_size, MAX_PACKETS_READ):
+                streams[pid] += data[start:end]
+    except (UnsupportedLayout, ValueError, OSError):
+        return None
+
+    for stream in streams.values():
+        pos = stream.find(MDPM_SIGNATURE)
+        if pos >= 0 and pos + len(MDPM_SIGNATURE) < len(stream):
+            dt = decode_datetime(parse_mdpm(bytes(stream[pos + len(MDPM_SIGNATURE):])))
+            if dt is not None:
+                return dt
+    return None
+
+
+def main():
+    for path in sys.argv[1:]:
+        print(f"{path}: {read_timestamp(path)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import struct
+import datetime
+import collections
+
+# Reads and writes the QuickTime creation/modification timestamps straight from/to the
+# mvhd, tkhd and mdhd boxes, seeking over everything else (including multi-GB mdat boxes)
+# so that only a few KB of the file are touched.
+
+QUICKTIME_EPOCH = datetime.datetime(1904, 1, 1, tzinfo=datetime.timezone.utc)
+
+TOP_LEVEL_BOX_TYPES = {b"ftyp", b"moov", b"mdat", b"free", b"skip", b"wide", b"pnot", b"uuid", b"meta"}
+
+# Maker notes that only exiftool knows how to decode
+MAKER_NOTE_BOX_TYPES = {b"NCDT"}
+
+TimestampField = collections.namedtuple("TimestampField", ("tag_name", "offset", "size"))
+
+
+class UnsupportedLayout(Exception):
+    pass
+
+
+class VerificationError(Exception):
+    pass
+
+
+def iter_boxes(f, start, end):
+    """Yield (type, payload_start, box_end) for each box between start and end."""
+    pos = start
+    while pos + 8 <= end:
+        f.seek(pos)
+        size, typ = struct.unpack(">I4s", f.read(8))
+        header_size = 8
+        if size == 1:
+            size, = struct.unpack(">Q", f.read(8))
+            header_size = 16
+        elif size == 0:
+            size = end - pos
+        if size < header_size or pos + size > end:
+            raise UnsupportedLayout(f"Bad size for box {typ!r}")
+        yield typ, pos + header_size, pos + size
+        pos += size
+
+
+def find_child(f, start, end, box_type):
+    for typ, child_start, child_end in iter_boxes(f, start, end):
+        if typ == box_type:
+            return child_start, child_end
+    return None
+
+
+def header_timestamp_fields(f, start, end, create_tag_name, modify_tag_name):
+    """Locate the creation and modification times in a full box such as mvhd, tkhd or mdhd."""
+    f.seek(start)
+    version = f.read(1)[0]
+    if version == 0:
+        size = 4
+    elif version == 1:
+        size = 8
+    else:
+        raise UnsupportedLayout(f"Unknown box version {version}")
+    if start + 4 + 2*size > end:
+        raise UnsupportedLayout("Truncated header box")
+    return [
+        TimestampField(create_tag_name, start + 4, size),
+        TimestampField(modify_tag_name, start + 4 + size, size),
+    ]
+
+
+def find_timestamp_fields(f):
+    """Locate the timestamps of the movie header and of every track and media header.
+
+    Returns a list of TimestampFields, and whether the file has maker notes.
+    """
+    file_size = os.fstat(f.fileno()).st_size
+
+    for i, (typ, start, end) in enumerate(iter_boxes(f, 0, file_size)):
+        if i == 0 and typ not in TOP_LEVEL_BOX_TYPES:
+            raise UnsupportedLayout("Not a QuickTime/MP4 file")
+        if typ == b"moov":
+            moov = start, end
+            break
+    else:
+        raise UnsupportedLayout("No moov box")
+
+    fields = []
+    has_maker_notes = False
+    for typ, start, end in iter_boxes(f, *moov):
+        if typ == b"mvhd":
+            fields += header_timestamp_fields(f, start, end, "Quicktime:CreateDate", "Quicktime:ModifyDate")
+        elif typ == b"trak":
+            for child_typ, child_start, child_end in iter_boxes(f, start, end):
+                if child_typ == b"tkhd":
+                    fields += header_timestamp_fields(
+                        f, child_start, child_end, "Quicktime:TrackCreateDate", "Quicktime:TrackModifyDate"
+                    )
+                elif child_typ == b"mdia":
+                    mdhd = find_child(f, child_start, child_end, b"mdhd")
+                    if mdhd is not None:
+                        fields += header_timestamp_fields(
+                            f, *mdhd, "Quicktime:MediaCreateDate", "Quicktime:MediaModifyDate"
+                        )
+        elif typ == b"udta":
+            for child_typ, _, _ in iter_boxes(f, start, end):
+                if child_typ in MAKER_NOTE_BOX_TYPES:
+                    has_maker_notes = True
+    return fields, has_maker_notes
+
+
+def read_field(f, field):
+    f.seek(field.offset)
+    data = f.read(field.size)
+    if len(data) != field.size:
+        raise UnsupportedLayout("Truncated timestamp")
+    return int.from_bytes(data, byteorder="big")
+
+
+def seconds_to_datetime(seconds):
+    return QUICKTIME_EPOCH + datetime.timedelta(seconds=seconds)
+
+
+def datetime_to_seconds(dt):
+    return (dt - QUICKTIME_EPOCH) // datetime.timedelta(seconds=1)
+
+
+def read_tags(path):
+    """Read the QuickTime timestamp tags of a file, as exiftool would report them.
+
+    Where there are several tracks, the first track's values are used. Unset (zero)
+    timestamps are left out. Returns None if the file isn't a QuickTime/MP4 file, or has
+    anything that only exiftool handles.
+    """
+    try:
+        with open(path, "rb") as f:
+            fields, has_maker_notes = find_timestamp_fields(f)
+            if has_maker_notes:
+                return None
+            result = {}
+            seen = set()
+            for field in fields:
+                if field.tag_name in seen:
+                    continue
+                seen.add(field.tag_name)
+                seconds = read_field(f, field)
+                if seconds != 0:
+                    result[field.tag_name] = seconds_to_datetime(seconds)
+            return result
+    except (UnsupportedLayout, struct.error, IndexError, OverflowError, OSError):
+        return None
+
+
+def write_tags(path, values):
+    """Patch QuickTime timestamp tags in place, without rewriting the rest of the file.
+
+    values maps tag names to aware datetimes, which are truncated to the second. Every
+    track's fields are written. The new values are read back afterwards, and
+    VerificationError is raised if they don't match. Returns False, without touching the
+    file, if its layout isn't recognised or a value doesn't fit in its field.
+    """
+    try:
+        with open(path, "r+b") as f:
+            fields, _ = find_timestamp_fields(f)
+            if not {t for t, v in values.items() if v is not None} <= {field.tag_name for field in fields}:
+                raise UnsupportedLayout("Not all tags are present")
+            patches = [
+                (field, datetime_to_seconds(values[field.tag_name]).to_bytes(field.size, byteorder="big"))
+                for field in fields
+                if values.get(field.tag_name) is not None
+            ]
+            for field, data in patches:
+                f.seek(field.offset)
+                f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+    except (UnsupportedLayout, struct.error, IndexError, OverflowError):
+        return False
+
+    with open(path, "rb") as f:
+        fields, _ = find_timestamp_fields(f)
+        expected = {(field.tag_name, field.offset): data for field, data in patches}
+        for field in fields:
+            data = expected.pop((field.tag_name, field.offset), None)
+            if data is not None and read_field(f, field) != int.from_bytes(data, byteorder="big"):
+                raise VerificationError(f"{path}: {field.tag_name} did not read back as written")
+        if expected:
+            raise VerificationError(f"{path}: timestamp fields moved while writing")
+    return True
+
+
+def main():
+    for path in sys.argv[1:]:
+        print(f"{path}: {read_tags(path)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import queue
+import pickle
+import threading
+import contextlib
+import subprocess
+import metadata_reader
+
+# FileStore's optional pool of worker processes for metadata_reader.read_tags, so parsing
+# doesn't hold the GTK process's GIL. Each worker runs this file as a script, so it only
+# imports metadata_reader and the format handlers; multiprocessing's forkserver and spawn
+# methods would import main.py (and so GTK and OpenCV) into every worker as well.
+
+
+class ReaderError(Exception):
+    pass
+
+
+class ReaderProcess:
+    """A long-lived process running read_tags requests.
+
+    Each request is a pickled (handler, path, file_type) tuple on its stdin, answered by
+    a pickled (succeeded, result) tuple on its stdout, where result is read_tags' return
+    value or the exception it raised.
+    """
+
+    def __init__(self):
+        self.proc = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__)],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+        )
+
+    def execute(self, handler, f, file_type):
+        pickle.dump((handler, f, file_type), self.proc.stdin)
+        self.proc.stdin.flush()
+        try:
+            return pickle.load(self.proc.stdout)
+        except EOFError:
+            raise ReaderError("Reader process exited unexpectedly")
+
+    def close(self):
+        try:
+            self.proc.stdin.close()
+            self.proc.wait(timeout=5)
+        except (OSError, subprocess.TimeoutExpired):
+            self.proc.kill()
+            self.proc.wait()
+
+
+class ReaderPool:
+    """A pool of ReaderProcess workers shared between threads, all started straight away."""
+
+    def __init__(self, size):
+        self.idle = queue.LifoQueue()
+        for _ in range(size):
+            self.idle.put(ReaderProcess())
+
+    @contextlib.contextmanager
+    def worker(self):
+        worker = self.idle.get()
+        try:
+            yield worker
+        except BaseException:
+            # The requests and responses may be out of step now, so replace it
+            worker.close()
+            self.idle.put(ReaderProcess())
+            raise
+        self.idle.put(worker)
+
+    def read_tags(self, handler, f, file_type):
+        """Run metadata_reader.read_tags in a worker process, raising whatever it raised."""
+        with self.worker() as worker:
+            succeeded, result = worker.execute(handler, f, file_type)
+        if not succeeded:
+            raise result
+        return result
+
+    def close(self):
+        while True:
+            try:
+                worker = self.idle.get_nowait()
+            except queue.Empty:
+                return
+            worker.close()
+
+
+def main():
+    requests = sys.stdin.buffer
+    responses = os.fdopen(os.dup(sys.stdout.fileno()), "wb")
+    # Anything else printed mustn't get mixed up with the responses
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    while True:
+        try:
+            handler, f, file_type = pickle.load(requests)
+        except EOFError:
+            return
+        try:
+            response = True, metadata_reader.read_tags(handler, f, file_type)
+        except Exception as e:
+            response = False, e
+        try:
+            data = pickle.dumps(response)
+        except Exception as e:
+            data = pickle.dumps((False, RuntimeError(f"{f}: {e!r}")))
+        responses.write(data)
+        responses.flush()
+
+
+if __name__ == "__main__":
+    main()
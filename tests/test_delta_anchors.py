@@ -0,0 +1,160 @@
+import datetime
+import unittest
+
+import numpy as np
+
+import delta_anchors
+
+START = datetime.datetime(2019, 8, 10, 12, tzinfo=datetime.timezone.utc)
+
+
+def timestamp(minutes):
+    return START + datetime.timedelta(minutes=minutes)
+
+
+def delta(seconds):
+    return datetime.timedelta(seconds=seconds)
+
+
+class AnchorsTest(unittest.TestCase):
+    """The deltas set through the dirty interval always match recomputing every row's delta."""
+
+    def setUp(self):
+        self.index = delta_anchors.TimestampIndex()
+        self.anchors = delta_anchors.Anchors()
+        self.default_delta = datetime.timedelta()
+        self.rows = []
+        for minutes in range(0, 100, 3):
+            row = {"full_path": "/photos/%03d.jpg" % minutes, "timestamp": timestamp(minutes), "state": None}
+            self.index.set(row, row["timestamp"])
+            self.rows.append(row)
+        # Every row starts off with the default delta, as on_row_loaded gives it
+        self.deltas = {row["full_path"]: 0.0 for row in self.rows}
+
+    def update(self, limit=None):
+        """Do what Application.update_dirty_deltas does, stopping after limit rows as if cancelled."""
+        rows, deltas, _ = self.anchors.dirty_rows(self.index, self.default_delta, lambda row: row["state"] is None)
+        for row, seconds in list(zip(rows, deltas.tolist()))[:limit]:
+            self.deltas[row["full_path"]] = seconds
+        if limit is None:
+            self.anchors.dirty_interval = None
+
+    def expected(self, row):
+        if len(self.anchors) == 0:
+            return self.default_delta.total_seconds()
+        return float(np.interp(
+            row["timestamp"].timestamp(),
+            [ts.timestamp() for ts in self.anchors.deltas.keys()],
+            [d.total_seconds() for d in self.anchors.deltas.values()],
+        ))
+
+    def assert_matches_full_recompute(self, rows=None):
+        for row in self.rows if rows is None else rows:
+            self.assertAlmostEqual(self.deltas[row["full_path"]], self.expected(row), msg=row["full_path"])
+
+    def test_first_and_last_anchor(self):
+        self.anchors.set(timestamp(30), delta(60))
+        self.assertEqual(self.anchors.dirty_interval, (None, None))
+        self.update()
+        self.assert_matches_full_recompute()
+        self.assertEqual(set(self.deltas.values()), {60.0})
+
+        self.anchors.remove(timestamp(30))
+        self.assertEqual(self.anchors.dirty_interval, (None, None))
+        self.update()
+        self.assert_matches_full_recompute()
+        self.assertEqual(set(self.deltas.values()), {0.0})
+
+    def test_only_neighbouring_interval_is_dirty(self):
+        self.anchors.set(timestamp(0), delta(0))
+        self.anchors.set(timestamp(99), delta(100))
+        self.update()
+        self.anchors.set(timestamp(30), delta(50))
+        self.assertEqual(self.anchors.dirty_interval, (timestamp(0).timestamp(), timestamp(99).timestamp()))
+        self.anchors.set(timestamp(60), delta(-20))
+        self.assertEqual(self.anchors.dirty_interval, (timestamp(0).timestamp(), timestamp(99).timestamp()))
+        self.update()
+        self.assert_matches_full_recompute()
+
+        self.anchors.set(timestamp(60), delta(10))
+        self.assertEqual(self.anchors.dirty_interval, (timestamp(30).timestamp(), timestamp(99).timestamp()))
+        rows, _, is_anchor = self.anchors.dirty_rows(self.index, self.default_delta, lambda row: True)
+        self.assertTrue(all(timestamp(30) <= row["timestamp"] <= timestamp(99) for row in rows))
+        self.assertEqual([row["timestamp"] for row, anchor in zip(rows, is_anchor) if anchor], [timestamp(30), timestamp(60), timestamp(99)])
+        self.update()
+        self.assert_matches_full_recompute()
+
+    def test_unlock_middle_anchor(self):
+        for minutes, seconds in ((6, 10), (45, 90), (90, -30)):
+            self.anchors.set(timestamp(minutes), delta(seconds))
+        self.update()
+        self.assert_matches_full_recompute()
+
+        self.anchors.remove(timestamp(45))
+        self.assertEqual(self.anchors.dirty_interval, (timestamp(6).timestamp(), timestamp(90).timestamp()))
+        self.update()
+        self.assert_matches_full_recompute()
+
+    def test_merge_after_cancelled_update(self):
+        self.anchors.set(timestamp(0), delta(0))
+        self.anchors.set(timestamp(99), delta(0))
+        self.update()
+        self.anchors.set(timestamp(21), delta(120))
+        # Cancelled part way through, so the rows from 21 to 99 minutes are still out of date
+        self.update(limit=5)
+        self.anchors.set(timestamp(9), delta(-60))
+        self.assertEqual(self.anchors.dirty_interval, (timestamp(0).timestamp(), timestamp(99).timestamp()))
+        self.update()
+        self.assert_matches_full_recompute()
+
+    def test_busy_rows_are_skipped(self):
+        busy = [row for row in self.rows if row["timestamp"] in (timestamp(30), timestamp(33))]
+        for row in busy:
+            row["state"] = "loading"
+        self.anchors.set(timestamp(0), delta(0))
+        self.anchors.set(timestamp(60), delta(60))
+        self.update()
+        for row in busy:
+            self.assertEqual(self.deltas[row["full_path"]], 0.0)
+        self.assert_matches_full_recompute([row for row in self.rows if row not in busy])
+
+        # Once they're done, they're given the delta from the anchors, as on_row_loaded does
+        for row in busy:
+            row["state"] = None
+            self.deltas[row["full_path"]] = self.anchors.get_delta(row["timestamp"], self.default_delta).total_seconds()
+        self.assert_matches_full_recompute()
+
+    def test_forget_saved_anchors(self):
+        for minutes, seconds in ((6, 10), (45, 90), (90, -30)):
+            self.anchors.set(timestamp(minutes), delta(seconds))
+        self.update()
+        saved = [row for row in self.rows if timestamp(39) <= row["timestamp"] <= timestamp(51)]
+        for row in saved:
+            row["state"] = "saved"
+        # Not an anchor, so it makes no difference
+        self.anchors.forget([timestamp(45), timestamp(48)])
+        self.assertEqual(list(self.anchors.deltas.keys()), [timestamp(6), timestamp(90)])
+        self.assertEqual(self.anchors.dirty_interval, (timestamp(6).timestamp(), timestamp(90).timestamp()))
+        self.update()
+        self.assert_matches_full_recompute([row for row in self.rows if row not in saved])
+
+        # Forgetting the last anchors leaves every row's delta as it is
+        before = dict(self.deltas)
+        self.anchors.forget([timestamp(6), timestamp(90)])
+        self.assertEqual(len(self.anchors), 0)
+        self.assertIsNone(self.anchors.dirty_interval)
+        self.update()
+        self.assertEqual(self.deltas, before)
+
+    def test_reindexed_row_moves(self):
+        row = self.rows[0]
+        row["timestamp"] = timestamp(50)
+        self.index.set(row, row["timestamp"])
+        self.assertEqual(len(self.index.entries), len(self.rows))
+        self.assertIn(row, [r for ts, r in self.index.entries_between(timestamp(49).timestamp(), timestamp(51).timestamp())])
+        self.index.set(row, None)
+        self.assertEqual(len(self.index.entries), len(self.rows) - 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,57 @@
+import os
+import json
+import tempfile
+import unittest
+
+import exiftool_pool
+
+FAKE_EXIFTOOL = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "fake_exiftool")
+
+
+class ExiftoolPoolTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.file = os.path.join(self.dir.name, "clip.mov")
+        open(self.file, "wb").close()
+        with open(self.file + ".fake_exiftool.json", "w") as f:
+            json.dump({"Quicktime:CreateDate": "2019:08:10 20:27:08"}, f)
+        self.pool = exiftool_pool.ExiftoolPool(size=2, executable=FAKE_EXIFTOOL)
+
+    def tearDown(self):
+        self.pool.close()
+        self.dir.cleanup()
+
+    def read_create_date(self):
+        stdout, _ = self.pool.execute("-json", "-d", "%Y-%m-%dT%H:%M:%S", "-Quicktime:CreateDate", self.file)
+        file_info, = json.loads(stdout)
+        return file_info["CreateDate"]
+
+    def test_read(self):
+        self.assertEqual(self.read_create_date(), "2019-08-10T20:27:08")
+        # The same worker answers the next request
+        self.assertEqual(self.read_create_date(), "2019-08-10T20:27:08")
+
+    def test_write(self):
+        stdout, _ = self.pool.execute("-overwrite_original", self.file, "-Quicktime:CreateDate=2020:01:02 03:04:05")
+        self.assertIn(b"1 image files updated", stdout)
+        self.assertEqual(self.read_create_date(), "2020-01-02T03:04:05")
+
+    def test_error(self):
+        missing = os.path.join(self.dir.name, "missing.mov")
+        with self.assertRaises(exiftool_pool.ExiftoolError):
+            self.pool.execute("-json", "-Quicktime:CreateDate", missing)
+        _, stderr = self.pool.execute("-json", "-Quicktime:CreateDate", missing, check=False)
+        self.assertIn(b"Error: File not found", stderr)
+        self.assertEqual(self.read_create_date(), "2019-08-10T20:27:08")
+
+    def test_lots_of_errors(self):
+        # More than a pipe buffer of errors on stderr mustn't deadlock with the response on stdout
+        missing = [os.path.join(self.dir.name, f"missing-{i:04d}-" + "x"*100) for i in range(1000)]
+        stdout, stderr = self.pool.execute("-json", "-Quicktime:CreateDate", *missing, self.file, check=False)
+        self.assertEqual(stderr.count(b"Error: File not found"), len(missing))
+        file_info, = json.loads(stdout)
+        self.assertEqual(file_info["SourceFile"], self.file)
+
+
+if __name__ == "__main__":
+    unittest.main()
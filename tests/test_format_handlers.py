@@ -0,0 +1,135 @@
+import os
+import struct
+import datetime
+import tempfile
+import unittest
+import importlib.util
+from unittest import mock
+
+if importlib.util.find_spec("pyexiv2") is None:
+    raise unittest.SkipTest("format_handlers needs pyexiv2")
+
+import file_types
+import exiftool_pool
+import format_handlers
+import metadata_reader
+import quicktime
+from metadata_reader import ALL_TAGS
+
+FAKE_EXIFTOOL = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "fake_exiftool")
+
+TIFF_ASCII = 2
+TIFF_LONG = 4
+TIFF_SSHORT = 8
+
+
+def ifd(entries, offset):
+    """An IFD at offset of (tag, type, count, value bytes) entries, followed by any values that don't fit in them."""
+    data_offset = offset + 2 + 12 * len(entries) + 4
+    out = struct.pack("<H", len(entries))
+    extra = b""
+    for tag, typ, count, value in entries:
+        if len(value) <= 4:
+            out += struct.pack("<HHI", tag, typ, count) + value.ljust(4, b"\0")
+        else:
+            out += struct.pack("<HHII", tag, typ, count, data_offset + len(extra))
+            extra += value
+    return out + b"\0\0\0\0" + extra
+
+
+def make_jpeg(timezone_offset=None):
+    ifd0_entries = [(0x0132, TIFF_ASCII, 20, b"2021:01:02 03:04:05\0")]
+    if timezone_offset is not None:
+        ifd0_entries.append((0x882a, TIFF_SSHORT, 1, struct.pack("<h", timezone_offset)))
+    ifd0_entries.append((0x8769, TIFF_LONG, 1, b"\0\0\0\0"))
+    exif_ifd_offset = 8 + len(ifd(ifd0_entries, 8))
+    ifd0_entries[-1] = (0x8769, TIFF_LONG, 1, struct.pack("<I", exif_ifd_offset))
+    tiff = (
+        b"II" + struct.pack("<HI", 42, 8)
+        + ifd(ifd0_entries, 8)
+        + ifd([(0x9003, TIFF_ASCII, 20, b"2021:01:02 03:04:05\0")], exif_ifd_offset)
+    )
+    app1 = b"Exif\0\0" + tiff
+    return b"\xff\xd8" + b"\xff\xe1" + struct.pack(">H", len(app1) + 2) + app1 + b"\xff\xda\0\x02\xff\xd9"
+
+
+class ImageHandlerTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.file = os.path.join(self.dir.name, "photo.jpg")
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def load_row(self):
+        """The row's values as FileStore.reload leaves them."""
+        tags, incomplete = format_handlers.ImageHandler.read(self.file, file_types.JPEG)
+        self.assertFalse(incomplete)
+        row = {tag_name: tags.get(tag_name) for tag_name in ALL_TAGS}
+        format_handlers.fill_in_exif_timezone_offset(row)
+        return row
+
+    def save(self, row, timezone_offset_hours):
+        handler = format_handlers.ImageHandler
+        timezone = datetime.timezone(datetime.timedelta(hours=timezone_offset_hours))
+        values = handler.new_values({t: row[t] for t in handler.tags}, datetime.timedelta(hours=1), timezone, timezone_offset_hours)
+        with mock.patch.object(metadata_reader, "get_exiv_metadata", side_effect=AssertionError("Not patched in place")):
+            return handler.write(self.file, values)
+
+    def test_guessed_offset_is_patched_in_place(self):
+        with open(self.file, "wb") as f:
+            f.write(make_jpeg())
+        row = self.load_row()
+        self.assertEqual(row["Exif.Image.TimeZoneOffset"], 0)
+        self.assertTrue(row[format_handlers.TIMEZONE_OFFSET_GUESSED])
+
+        written = self.save(row, 2)
+        self.assertNotIn("Exif.Image.TimeZoneOffset", written)
+        row = self.load_row()
+        self.assertTrue(row[format_handlers.TIMEZONE_OFFSET_GUESSED])
+        # Still in the guessed time zone
+        self.assertEqual(row["Exif.Photo.DateTimeOriginal"], datetime.datetime(2021, 1, 2, 4, 4, 5))
+        self.assertEqual(row["Exif.Image.DateTime"], datetime.datetime(2021, 1, 2, 4, 4, 5))
+
+    def test_offset_from_file_is_patched_in_place(self):
+        with open(self.file, "wb") as f:
+            f.write(make_jpeg(timezone_offset=-5))
+        row = self.load_row()
+        self.assertFalse(row[format_handlers.TIMEZONE_OFFSET_GUESSED])
+
+        written = self.save(row, 2)
+        self.assertEqual(written["Exif.Image.TimeZoneOffset"], 2)
+        row = self.load_row()
+        self.assertEqual(row["Exif.Image.TimeZoneOffset"], 2)
+        self.assertEqual(row["Exif.Photo.DateTimeOriginal"], datetime.datetime(2021, 1, 2, 11, 4, 5))
+
+
+class QuickTimeHandlerTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.file = os.path.join(self.dir.name, "clip.mov")
+        self.exiftool = exiftool_pool.ExiftoolPool(size=1, executable=FAKE_EXIFTOOL)
+
+    def tearDown(self):
+        self.exiftool.close()
+        self.dir.cleanup()
+
+    def test_overflow_falls_back_to_exiftool(self):
+        created = quicktime.datetime_to_seconds(datetime.datetime(2019, 8, 10, tzinfo=datetime.timezone.utc))
+        mvhd = struct.pack(">I4s", 32, b"mvhd") + bytes(4) + struct.pack(">II", created, created) + bytes(12)
+        data = struct.pack(">I4s", 8 + len(mvhd), b"moov") + mvhd
+        with open(self.file, "wb") as f:
+            f.write(data)
+        # Past what a version 0 mvhd's 32 bits of seconds since 1904 can hold
+        values = {"Quicktime:CreateDate": datetime.datetime(2041, 1, 2, 3, 4, 5, tzinfo=datetime.timezone.utc)}
+        # The test stands in for the FileStore, which only has to provide the exiftool pool
+        written = format_handlers.QuickTimeHandler.write(self, self.file, values)
+        self.assertEqual(written, values)
+        with open(self.file, "rb") as f:
+            self.assertEqual(f.read(), data)
+        stdout, _ = self.exiftool.execute("-json", "-Quicktime:CreateDate", self.file)
+        self.assertIn(b"2041:01:02 03:04:05", stdout)
+
+
+if __name__ == "__main__":
+    unittest.main()
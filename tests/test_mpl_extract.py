@@ -0,0 +1,178 @@
+import os
+import json
+import struct
+import datetime
+import tempfile
+import unittest
+
+import mpl_extract
+
+
+def bcd(value):
+    return int(str(value), 16)
+
+
+def descriptor(mts_number, dt):
+    """A playlist's descriptor of one clip, as written by the camera."""
+    body = (
+        mpl_extract.MplFile.TIMESTAMP_SIG
+        + mpl_extract.MplFile.TIMESTAMP_STRUCT.pack(
+            mts_number, 0x1E, bcd(dt.year), *(bcd(v) for v in (dt.month, dt.day, dt.hour, dt.minute, dt.second)),
+            b"\x90\x0A", f"{dt.year:4d}.{dt.month:2d}.{dt.day:2d}".encode("ascii"),
+        )
+    )
+    return body.ljust(mpl_extract.MplFile.DESC_SIZE, b"\0")
+
+
+def make_playlist(clips):
+    head = bytearray(mpl_extract.MplFile.SIGNATURE.ljust(200, b"\0"))
+    head[mpl_extract.MplFile.NUM_DESC_POS] = len(clips)
+    descriptors = b"".join(descriptor(mts_number, dt) for mts_number, dt in clips)
+    return bytes(head) + descriptors + b"\0" * (mpl_extract.MplFile.TRAILER_SIZE - 2)
+
+
+def make_clip_info(atc_sequences):
+    """A CLIPINF file with the given ATC sequences, each a list of (start, end) STC sequences in 45kHz ticks."""
+    sequence_info = struct.pack(">IxB", 0, len(atc_sequences))
+    for stc_sequences in atc_sequences:
+        sequence_info += struct.pack(">IBB", 0, len(stc_sequences), 0)
+        for start, end in stc_sequences:
+            sequence_info += struct.pack(">HIII", 0x1001, 0, start, end)
+    sequence_info_pos = mpl_extract.ClpiFile.CLIP_INFO_POS + mpl_extract.ClpiFile.CLIP_INFO_STRUCT.size
+    header = mpl_extract.ClpiFile.HEADER_STRUCT.pack(b"HDMV", b"0200", sequence_info_pos, 0, 0, 0, 0)
+    clip_info = mpl_extract.ClpiFile.CLIP_INFO_STRUCT.pack(0, 0, 1, 1, 0, 0, 12345)
+    return header.ljust(mpl_extract.ClpiFile.CLIP_INFO_POS, b"\0") + clip_info + sequence_info
+
+
+class MplDirectoryTest(unittest.TestCase):
+    CLIPS = [(1, datetime.datetime(2019, 8, 10, 20, 27, 8)), (2, datetime.datetime(2019, 8, 10, 21, 0, 0))]
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, "PRIVATE", "AVCHD", "BDMV")
+        self.playlists = [
+            os.path.join(self.path, "PLAYLIST", "00000.MPL"),
+            os.path.join(self.path, "BACKUP", "PLAYLIST", "00000.MPL"),
+        ]
+        for playlist in self.playlists:
+            os.makedirs(os.path.dirname(playlist))
+            with open(playlist, "wb") as f:
+                f.write(make_playlist(self.CLIPS))
+        os.makedirs(os.path.join(self.path, "CLIPINF"))
+        with open(os.path.join(self.path, "CLIPINF", "00001.CPI"), "wb") as f:
+            f.write(make_clip_info([[(45000, 45000 * 91)]]))
+        self.avchd = mpl_extract.MplDirectory(self.path)
+        self.avchd.read()
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def stream_path(self, mts_number):
+        return self.avchd.stream_path(f"{mts_number:05d}.MTS")
+
+    def leftover_temp_files(self):
+        return [
+            file
+            for _, _, files in os.walk(self.dir.name)
+            for file in files
+            if file.endswith(".tmp")
+        ]
+
+    def test_read(self):
+        self.assertEqual(len(self.avchd.clips[self.stream_path(1)]), 2)
+        # The copy outside BACKUP comes first
+        mpl, _ = self.avchd.get_clip(self.stream_path(1))
+        self.assertEqual(mpl.filepath, self.playlists[0])
+        self.assertEqual(self.avchd.get_mts(self.stream_path(2))["datetime"], self.CLIPS[1][1])
+        self.assertEqual(self.avchd.get_clip_end(self.stream_path(1)), self.CLIPS[0][1] + datetime.timedelta(seconds=90))
+        # Its CLIPINF file is missing
+        self.assertIsNone(self.avchd.get_clip_end(self.stream_path(2)))
+
+    def test_write_every_copy(self):
+        new_dt = datetime.datetime(2020, 1, 2, 3, 4, 5, tzinfo=datetime.timezone(datetime.timedelta(hours=2)))
+        self.avchd.set_datetime(self.stream_path(1), new_dt)
+        self.avchd.write()
+        self.assertEqual(self.leftover_temp_files(), [])
+
+        for playlist in self.playlists:
+            mpl = mpl_extract.MplFile(playlist)
+            self.assertEqual(mpl.get_mts("00001.MTS")["datetime"], new_dt)
+            self.assertEqual(mpl.get_mts("00002.MTS")["datetime"], self.CLIPS[1][1])
+            with open(playlist + ".timezone.json") as f:
+                self.assertEqual(json.load(f), {"00001.MTS": 2 * 60 * 60})
+        self.assertFalse(any(info.dirty for mpl in self.avchd.mpl_files.values() for info in mpl.db.values()))
+
+        # Nothing is written when nothing has changed
+        os.remove(self.playlists[0] + ".timezone.json")
+        self.avchd.write()
+        self.assertFalse(os.path.exists(self.playlists[0] + ".timezone.json"))
+
+    def test_nothing_written_if_a_copy_changed(self):
+        with open(self.playlists[1], "r+b") as f:
+            f.seek(self.avchd.clips[self.stream_path(1)][1][1].seek_pos)
+            f.write(b"\xff\xff")
+        with open(self.playlists[0], "rb") as f:
+            original = f.read()
+
+        self.avchd.set_datetime(self.stream_path(1), datetime.datetime(2020, 1, 2, 3, 4, 5))
+        with self.assertRaises(mpl_extract.MplFileException):
+            self.avchd.write()
+        with open(self.playlists[0], "rb") as f:
+            self.assertEqual(f.read(), original)
+        self.assertFalse(os.path.exists(self.playlists[0] + ".timezone.json"))
+        self.assertEqual(self.leftover_temp_files(), [])
+        # Still to be written
+        self.assertTrue(self.avchd.get_mts(self.stream_path(1)).dirty)
+
+    def test_write_files_atomically_cleans_up(self):
+        with open(self.playlists[0], "rb") as f:
+            original = f.read()
+        with self.assertRaises(OSError):
+            mpl_extract.write_files_atomically([
+                (self.playlists[0], b"new contents"),
+                (os.path.join(self.path, "MISSING", "00000.MPL"), b"new contents"),
+            ])
+        with open(self.playlists[0], "rb") as f:
+            self.assertEqual(f.read(), original)
+        self.assertEqual(self.leftover_temp_files(), [])
+
+
+class ClpiFileTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.file = os.path.join(self.dir.name, "00001.CPI")
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def read(self, data):
+        with open(self.file, "wb") as f:
+            f.write(data)
+        return mpl_extract.ClpiFile(self.file)
+
+    def test_read(self):
+        clip_info = self.read(make_clip_info([[(1000, 1000 + 45000 * 10)], [(0, 45000), (90000, 90000 + 22500)]]))
+        self.assertEqual(clip_info.version, "0200")
+        self.assertEqual(clip_info.number_of_source_packets, 12345)
+        self.assertEqual([len(atc.stc_sequences) for atc in clip_info.atc_sequences], [1, 2])
+        self.assertEqual(clip_info.presentation_start_time, 1000)
+        self.assertEqual(clip_info.duration, datetime.timedelta(seconds=11.5))
+
+    def test_clock_wraps_around(self):
+        clip_info = self.read(make_clip_info([[(2**32 - 45000, 45000)]]))
+        self.assertEqual(clip_info.duration, datetime.timedelta(seconds=2))
+
+    def test_no_sequences(self):
+        clip_info = self.read(make_clip_info([]))
+        self.assertIsNone(clip_info.presentation_start_time)
+        self.assertEqual(clip_info.duration, datetime.timedelta())
+
+    def test_bad_files(self):
+        with self.assertRaises(mpl_extract.ClpiFileException):
+            self.read(b"MPLS0100" + bytes(100))
+        with self.assertRaises(mpl_extract.ClpiFileException):
+            self.read(make_clip_info([[(0, 45000)]])[:-4])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,93 @@
+import os
+import datetime
+import tempfile
+import unittest
+
+import file_types
+import mts
+
+VIDEO_PID = 0x1011
+AUDIO_PID = 0x1100
+
+
+def mdpm_sei(date, time):
+    """A user data SEI NAL unit holding an MDPM with the given date and time entries."""
+    entries = [bytes([mts.MDPM_DATE_TAG]) + date, bytes([mts.MDPM_TIME_TAG]) + time, b"\x70\x01\x02\x03\x04"]
+    payload = mts.MDPM_SIGNATURE + bytes([len(entries)]) + b"".join(entries)
+    return b"\0\0\0\1\x06\x05" + bytes([len(payload)]) + payload
+
+
+def packet(pid, payload, timecode=True):
+    payload = payload[:mts.TS_PACKET_SIZE - 4].ljust(mts.TS_PACKET_SIZE - 4, b"\xff")
+    data = bytes([mts.TS_SYNC_BYTE, 0x40 | (pid >> 8), pid & 0xff, 0x10]) + payload
+    return (b"\0" * mts.TIMECODE_SIZE if timecode else b"") + data
+
+
+def make_stream(date=b"\x12\x20\x19\x07", time=b"\x04\x13\x45\x59", timecode=True, split=None):
+    # A PES header, an access unit delimiter, and then the SEI
+    pes = b"\0\0\1\xe0\0\0\x80\x80\x05\x21\0\1\0\1" + b"\0\0\0\1\x09\x10" + mdpm_sei(date, time)
+    first, rest = (pes, b"\x11" * 10) if split is None else (pes[:split], pes[split:])
+    return b"".join((
+        packet(VIDEO_PID, first, timecode),
+        packet(AUDIO_PID, b"audio" * 30, timecode),
+        packet(VIDEO_PID, rest, timecode),
+    ))
+
+
+class ReadTimestampTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.file = os.path.join(self.dir.name, "00001.MTS")
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def read_timestamp(self, data):
+        with open(self.file, "wb") as f:
+            f.write(data)
+        return mts.read_timestamp(self.file)
+
+    def test_timecoded_packets(self):
+        data = make_stream()
+        self.assertEqual(file_types.sniff_bytes(data[:file_types.SNIFF_SIZE]), file_types.MTS)
+        self.assertEqual(
+            self.read_timestamp(data),
+            datetime.datetime(2019, 7, 4, 13, 45, 59, tzinfo=datetime.timezone(datetime.timedelta(hours=9))),
+        )
+
+    def test_plain_packets(self):
+        data = make_stream(timecode=False)
+        self.assertEqual(mts.find_packet_layout(data), (0, mts.TS_PACKET_SIZE))
+        self.assertEqual(file_types.sniff_bytes(data[:file_types.SNIFF_SIZE]), file_types.MTS)
+        self.assertEqual(self.read_timestamp(data).replace(tzinfo=None), datetime.datetime(2019, 7, 4, 13, 45, 59))
+
+    def test_sei_across_packets(self):
+        self.assertEqual(self.read_timestamp(make_stream(split=60)).replace(tzinfo=None), datetime.datetime(2019, 7, 4, 13, 45, 59))
+
+    def test_time_zones(self):
+        # Negative, with half an hour
+        dt = self.read_timestamp(make_stream(date=b"\x2b\x20\x19\x07"))
+        self.assertEqual(dt.utcoffset(), -datetime.timedelta(hours=5, minutes=30))
+        # Unknown
+        self.assertIsNone(self.read_timestamp(make_stream(date=b"\x80\x20\x19\x07")).tzinfo)
+
+    def test_emulation_prevention(self):
+        # The time's 00 00 03 is an escaped 00 00
+        dt = self.read_timestamp(make_stream(time=b"\x04\x00\x00\x03\x01"))
+        self.assertEqual(dt.replace(tzinfo=None), datetime.datetime(2019, 7, 4, 0, 0, 1))
+
+    def test_bad_bcd(self):
+        self.assertIsNone(self.read_timestamp(make_stream(time=b"\x04\x1a\x45\x59")))
+        with self.assertRaises(ValueError):
+            mts.bcd_byte_to_int(0xa0)
+
+    def test_not_a_transport_stream(self):
+        data = b"\xff\xd8\xff" + b"\0" * 1000
+        self.assertFalse(file_types.is_transport_stream(data))
+        self.assertIsNone(self.read_timestamp(data))
+        with self.assertRaises(mts.UnsupportedLayout):
+            mts.find_packet_layout(make_stream()[:mts.TIMECODE_SIZE + mts.TS_PACKET_SIZE])
+
+
+if __name__ == "__main__":
+    unittest.main()
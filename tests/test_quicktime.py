@@ -0,0 +1,129 @@
+import os
+import struct
+import datetime
+import tempfile
+import unittest
+from unittest import mock
+
+import quicktime
+
+UTC = datetime.timezone.utc
+CREATED = datetime.datetime(2019, 8, 10, 20, 27, 8, tzinfo=UTC)
+MODIFIED = datetime.datetime(2019, 8, 10, 20, 30, tzinfo=UTC)
+NEW_VALUES = {
+    "Quicktime:CreateDate": datetime.datetime(2020, 1, 2, 3, 4, 5, tzinfo=UTC),
+    "Quicktime:ModifyDate": datetime.datetime(2020, 1, 2, 3, 4, 6, tzinfo=UTC),
+    "Quicktime:TrackCreateDate": datetime.datetime(2020, 1, 2, 3, 4, 7, tzinfo=UTC),
+    "Quicktime:TrackModifyDate": datetime.datetime(2020, 1, 2, 3, 4, 8, tzinfo=UTC),
+    "Quicktime:MediaCreateDate": datetime.datetime(2020, 1, 2, 3, 4, 9, tzinfo=UTC),
+    "Quicktime:MediaModifyDate": datetime.datetime(2020, 1, 2, 3, 4, 10, tzinfo=UTC),
+}
+
+
+def box(typ, payload, large=False):
+    if large:
+        return struct.pack(">I4sQ", 1, typ, len(payload) + 16) + payload
+    return struct.pack(">I4s", len(payload) + 8, typ) + payload
+
+
+def header_box(typ, version, created, modified):
+    created = quicktime.datetime_to_seconds(created)
+    modified = quicktime.datetime_to_seconds(modified)
+    if version == 0:
+        timestamps = struct.pack(">II", created, modified)
+    else:
+        timestamps = struct.pack(">QQ", created, modified)
+    # Only the version, flags and timestamps matter here
+    return box(typ, bytes([version, 0, 0, 0]) + timestamps + b"\0" * 20)
+
+
+def make_movie(version=0, moov_first=False, large=False, n_tracks=2):
+    tracks = b"".join(
+        box(b"trak", header_box(b"tkhd", version, CREATED, MODIFIED) + box(b"mdia", header_box(b"mdhd", version, CREATED, MODIFIED)))
+        for _ in range(n_tracks)
+    )
+    moov = box(b"moov", header_box(b"mvhd", version, CREATED, MODIFIED) + tracks, large=large)
+    mdat = box(b"mdat", b"\0" * 4096, large=large)
+    ftyp = box(b"ftyp", b"qt  \0\0\0\0")
+    return ftyp + (moov + mdat if moov_first else mdat + moov)
+
+
+class WriteTagsTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.file = os.path.join(self.dir.name, "clip.mov")
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def write_movie(self, data):
+        with open(self.file, "wb") as f:
+            f.write(data)
+
+    def assert_round_trip(self, data):
+        self.write_movie(data)
+        self.assertEqual(quicktime.read_tags(self.file)["Quicktime:CreateDate"], CREATED)
+        self.assertTrue(quicktime.write_tags(self.file, NEW_VALUES))
+        self.assertEqual(quicktime.read_tags(self.file), NEW_VALUES)
+        self.assertEqual(os.path.getsize(self.file), len(data))
+        # Every track is written, not just the first one that read_tags reports
+        with open(self.file, "rb") as f:
+            fields, _ = quicktime.find_timestamp_fields(f)
+            self.assertEqual(len(fields), 2 + 4 * 2)
+            for field in fields:
+                self.assertEqual(quicktime.read_field(f, field), quicktime.datetime_to_seconds(NEW_VALUES[field.tag_name]))
+
+    def test_version_0(self):
+        self.assert_round_trip(make_movie(version=0))
+
+    def test_version_1(self):
+        self.assert_round_trip(make_movie(version=1))
+
+    def test_moov_before_mdat(self):
+        self.assert_round_trip(make_movie(moov_first=True))
+
+    def test_64_bit_box_sizes(self):
+        self.assert_round_trip(make_movie(large=True))
+
+    def test_box_to_end_of_file(self):
+        data = make_movie()
+        moov_start = data.index(b"moov") - 4
+        self.assert_round_trip(data[:moov_start] + b"\0\0\0\0" + data[moov_start + 4:])
+
+    def test_only_given_tags_change(self):
+        self.write_movie(make_movie())
+        self.assertTrue(quicktime.write_tags(self.file, {"Quicktime:CreateDate": NEW_VALUES["Quicktime:CreateDate"]}))
+        tags = quicktime.read_tags(self.file)
+        self.assertEqual(tags["Quicktime:CreateDate"], NEW_VALUES["Quicktime:CreateDate"])
+        self.assertEqual(tags["Quicktime:ModifyDate"], MODIFIED)
+        self.assertEqual(tags["Quicktime:TrackCreateDate"], CREATED)
+
+    def test_overflow(self):
+        data = make_movie(version=0)
+        self.write_movie(data)
+        # Past what 32 bits of seconds since 1904 can hold
+        values = {"Quicktime:CreateDate": datetime.datetime(2041, 1, 1, tzinfo=UTC)}
+        self.assertFalse(quicktime.write_tags(self.file, values))
+        with open(self.file, "rb") as f:
+            self.assertEqual(f.read(), data)
+
+    def test_missing_tag(self):
+        data = make_movie(n_tracks=0)
+        self.write_movie(data)
+        self.assertFalse(quicktime.write_tags(self.file, NEW_VALUES))
+        with open(self.file, "rb") as f:
+            self.assertEqual(f.read(), data)
+
+    def test_not_a_movie(self):
+        self.write_movie(b"\xff\xd8\xff\xe0" + b"\0" * 100)
+        self.assertFalse(quicktime.write_tags(self.file, NEW_VALUES))
+
+    def test_verification(self):
+        self.write_movie(make_movie())
+        with mock.patch.object(quicktime, "read_field", return_value=0):
+            with self.assertRaises(quicktime.VerificationError):
+                quicktime.write_tags(self.file, NEW_VALUES)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,40 @@
+import os
+import tempfile
+import unittest
+import importlib.util
+
+if importlib.util.find_spec("pyexiv2") is None:
+    raise unittest.SkipTest("metadata_reader needs pyexiv2")
+
+import file_types
+import format_handlers
+import metadata_reader
+import reader_pool
+
+
+class ReaderPoolTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.file = os.path.join(self.dir.name, "notes.txt")
+        with open(self.file, "w") as f:
+            f.write("Not a photo")
+        self.pool = reader_pool.ReaderPool(size=2)
+
+    def tearDown(self):
+        self.pool.close()
+        self.dir.cleanup()
+
+    def test_read(self):
+        expected = metadata_reader.read_tags(format_handlers.QuickTimeHandler, self.file, file_types.ISOBMFF)
+        for _ in range(3):
+            self.assertEqual(self.pool.read_tags(format_handlers.QuickTimeHandler, self.file, file_types.ISOBMFF), expected)
+
+    def test_error(self):
+        with self.assertRaises(AttributeError):
+            self.pool.read_tags(None, self.file, file_types.ISOBMFF)
+        # The worker is still usable
+        self.test_read()
+
+
+if __name__ == "__main__":
+    unittest.main()